@@ -1,123 +1,460 @@
+import io
 import zipfile
-import json
 import os
-from lxml import etree
+import argparse
+import asyncio
+import time
+import httpx  # installed with ollama
 import ollama  # <--- NEW: Requires 'pip install ollama'
 
 # --- IMPORT YOUR MODULE ---
-from Office2JSON import __create_json
+from metrics import enable as enable_metrics, get_metrics
+from ooxml_stream import (NAMESPACES, DEFAULT_LIMITS, DEFAULT_TRIGGERS, DocumentScan, clean_tag,
+                          get_matcher, get_vocabulary, scan_document, sieve_document)
+from resource_limits import ResourceLimitExceeded
+from prompt_builder import PromptBuilder, DEFAULT_MAX_CHARS
+from verdicts import ERROR_SCORE, Verdict, VerdictError, error_verdict, load_json, parse_verdict
+
+def is_zip(source):
+    """zipfile.is_zipfile for a path or for the document's bytes"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return zipfile.is_zipfile(source)
 
 class SFEM_Analyzer:
-    """ (Kept EXACTLY the same as before) """
-    NAMESPACES = {
-        'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
-        'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
-        'p': 'http://schemas.openxmlformats.org/presentationml/2006/main',
-        'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
-    }
-
-    def __init__(self, filepath):
+    """Stage 1: The Sieve (structural paths, read in one streaming pass)
+
+    filepath may also be the document's bytes (e.g. an attachment received
+    by scan_daemon), anything Office2JSON.open_zip accepts.
+    """
+    NAMESPACES = NAMESPACES
+    SUSPICIOUS_TRIGGERS = DEFAULT_TRIGGERS
+
+    def __init__(self, filepath, triggers=None, limits=None):
         self.filepath = filepath
-        self.unique_paths = set()
+        self.scan_limits = limits or DEFAULT_LIMITS  # ooxml_stream.ScanLimits
+        self.limits = {}  # caps that fired: limit -> part name
+        self.resource_limit = None  # set when the decompression caps refused the file
+        self.path_ids = set()  # interned, see ooxml_stream.PathVocabulary
+        self.content = None
+        self.matcher = get_matcher(tuple(triggers or self.SUSPICIOUS_TRIGGERS))
+        self.trigger = None
+        self.tier = None
+        self.directory = None
 
     def _clean_tag(self, tag):
-        if '}' in tag:
-            ns_url, tag_name = tag[1:].split('}')
-            for prefix, url in self.NAMESPACES.items():
-                if ns_url == url:
-                    return f"{prefix}:{tag_name}"
-            return tag_name
-        return tag
-
-    def _recurse_xml(self, element, current_path):
-        tag_name = self._clean_tag(element.tag)
-        new_path = f"{current_path}\\{tag_name}" if current_path else tag_name
-        self.unique_paths.add(new_path)
-        for child in element:
-            self._recurse_xml(child, new_path)
-
-    def extract_structure(self):
-        if not zipfile.is_zipfile(self.filepath):
+        return clean_tag(tag)
+
+    @property
+    def unique_paths(self):
+        """The structural paths as strings"""
+        return get_vocabulary().decode(self.path_ids)
+
+    def _refuse(self, e, stage):
+        self.resource_limit = e.to_dict()
+        get_metrics().inc("resource_limits_total", limit=e.limit, stage=stage)
+        print(f"SFEM Refused: {e}")
+
+    def _record_limits(self, scan, stage):
+        metrics = get_metrics()
+        for limit, part in scan.limits.items():
+            self.limits.setdefault(limit, part)
+            metrics.inc("limits_total", limit=limit, stage=stage)
+
+    def path_array(self):
+        """The structure as a sorted uint32 array of vocabulary ids (see path_sets)"""
+        from path_sets import to_array
+        return to_array(self.path_ids)
+
+    def extract_structure(self, with_content=False):
+        """Fills unique_paths; with_content=True also keeps the Office2JSON
+        content dict in self.content from the same pass over the zip."""
+        if not is_zip(self.filepath):
             return []
+        metrics = get_metrics()
+        scan = DocumentScan()
+        scan.path_ids = self.path_ids
         try:
-            with zipfile.ZipFile(self.filepath, 'r') as z:
-                file_list = z.namelist()
-                for f in file_list:
-                    path_str = f.replace('/', '\\')
-                    self.unique_paths.add(path_str)
-                    if f.endswith('.xml') or f.endswith('.rels'):
-                        try:
-                            xml_content = z.read(f)
-                            root = etree.fromstring(xml_content)
-                            self._recurse_xml(root, path_str)
-                        except etree.XMLSyntaxError:
-                            pass
+            with metrics.timer("sfem_extract"):
+                scan_document(self.filepath, with_content=with_content, scan=scan,
+                              limits=self.scan_limits)
+            if with_content:
+                self.content = scan.content
+        except ResourceLimitExceeded as e:
+            self._refuse(e, "sfem_extract")
         except Exception as e:
+            metrics.inc("errors_total", stage="sfem_extract")
             print(f"SFEM Error: {e}")
-        return sorted(list(self.unique_paths))
+        self._record_limits(scan, "sfem_extract")
+        metrics.inc("parts_read_total", scan.parts_read, stage="sfem_extract")
+        metrics.inc("bytes_read_total", scan.bytes_read, stage="sfem_extract")
+        return sorted(self.unique_paths)
 
     def run_sieve(self):
-        self.extract_structure()
-        suspicious_triggers = [
-            "vbaProject.bin", "macrosheets", "activeX", "oleObject", "w:fldSimple"
-        ]
-        for path in self.unique_paths:
-            for trigger in suspicious_triggers:
-                if trigger in path:
+        """True if any structural path contains a trigger; the hit is kept in self.trigger.
+
+        If the structure was already extracted the paths are just matched.
+        Otherwise the tiered sieve runs (see ooxml_stream.sieve_document) and
+        self.tier records which tier decided: 0 = central directory only,
+        1 = XML parts had to be parsed. path_ids is then only what that
+        tier looked at; call extract_structure() for the full set.
+        If a ScanLimits cap fired (see self.limits) the verdict only covers
+        what was parsed before it. A package refused by the decompression
+        caps counts as flagged, with the details in self.resource_limit.
+        """
+        if self.path_ids:
+            self.tier = None
+            paths = get_vocabulary().paths
+            for path_id in self.path_ids:
+                self.trigger = self.matcher.search(paths[path_id])
+                if self.trigger:
                     return True
-        return False
+            return False
+
+        if not is_zip(self.filepath):
+            return False
+        metrics = get_metrics()
+        scan = DocumentScan()
+        scan.path_ids = self.path_ids
+        try:
+            with metrics.timer("sieve"):
+                sieve_document(self.filepath, self.matcher, scan=scan, limits=self.scan_limits)
+        except ResourceLimitExceeded as e:
+            self._refuse(e, "sieve")
+        except Exception as e:
+            metrics.inc("errors_total", stage="sieve")
+            print(f"SFEM Error: {e}")
+        self.trigger = scan.trigger
+        self.tier = scan.tier
+        self.directory = scan.directory
+        self._record_limits(scan, "sieve")
+        metrics.inc("parts_read_total", scan.parts_read, stage="sieve")
+        metrics.inc("bytes_read_total", scan.bytes_read, stage="sieve")
+        flagged = self.trigger is not None or self.resource_limit is not None
+        metrics.inc("sieve_total", tier=self.tier, outcome="flagged" if flagged else "clean")
+        return flagged
+
+# Shared with build_dataset so training and inference prompts match
+INSTRUCTION = "Analyze this Office File for malware. Return JSON {score, reason}."
+BATCH_INSTRUCTION = ("Analyze each Office File below for malware, independently. Return JSON "
+                     "{verdicts: [{id, score, reason}]} with exactly one verdict per document id.")
+DEFAULT_BATCH_DOC_CHARS = 6000  # context per document inside a batched prompt
+
+def parse_batch_verdicts(text, ids):
+    """{doc_id: verdict JSON string} for every well-formed verdict in a
+    batched reply. Accepts {"verdicts": [...]}, a bare array, or an object
+    keyed by document id; each entry must pass the Verdict schema."""
+    try:
+        data, repaired = load_json(text)
+    except VerdictError:
+        return {}
+
+    if isinstance(data, dict) and isinstance(data.get("verdicts"), list):
+        entries = data["verdicts"]
+    elif isinstance(data, list):
+        entries = data
+    elif isinstance(data, dict):
+        entries = [dict(v, id=k) for k, v in data.items() if isinstance(v, dict)]
+    else:
+        return {}
+
+    verdicts = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        doc_id = str(entry.get("id", ""))
+        if doc_id not in ids or doc_id in verdicts:
+            continue
+        try:
+            verdict = Verdict.from_dict(entry, lenient=repaired)
+        except VerdictError:
+            continue
+        if not verdict.is_error:
+            verdicts[doc_id] = verdict.to_json()
+    return verdicts
+
+def resource_limit_verdict(limit):
+    """Verdict for a package refused by the decompression caps (resource_limits);
+    such files never reach the model. Nobody judged the content, so it is
+    error-style (score -1, like a failed model call): not cached, not
+    inherited by near-duplicates, not counted as malicious. The
+    "resource_limit" object tells it apart from other errors."""
+    return Verdict(ERROR_SCORE,
+                   f"Resource limit: {limit['limit']} exceeded"
+                   + (f" by {limit['member']}" if limit.get("member") else "")
+                   + " (possible decompression bomb); not analyzed.",
+                   resource_limit=limit).to_json()
 
 class LocalMalwareScanner:
-    """Stage 3: The Brain (Powered by Local Ollama)"""
-    
-    def __init__(self, model_name="malware-scanner"):
+    """Stage 3: The Brain (Powered by Local Ollama)
+
+    analyze() is the blocking one-file call. analyze_async()/analyze_many()
+    keep up to `concurrency` requests in flight on one reused connection pool.
+    Every request, sync or async, gets the per-request timeout and retries
+    (exponential backoff) when the server can't be reached or doesn't answer.
+    `host` defaults to OLLAMA_HOST / localhost:11434.
+    """
+
+    # Bump whenever build_prompt changes, so cached verdicts from the old prompt miss
+    PROMPT_VERSION = "3"
+
+    # Failures worth retrying: server not up yet, dropped connection, timeout
+    RETRYABLE_ERRORS = (ConnectionError, httpx.TransportError, asyncio.TimeoutError)
+
+    def __init__(self, model_name="malware-scanner", host=None, concurrency=4,
+                 timeout=120.0, retries=3, backoff=0.5, max_prompt_chars=DEFAULT_MAX_CHARS,
+                 batch_doc_chars=DEFAULT_BATCH_DOC_CHARS):
         self.model = model_name
+        self.host = host
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_prompt_chars = max_prompt_chars
+        self.prompt_builder = PromptBuilder(max_chars=max_prompt_chars)
+        self.batch_builder = PromptBuilder(max_chars=min(batch_doc_chars, max_prompt_chars))
+        self._client = ollama.Client(host=host, timeout=timeout)
+        self._async_client = None
+        self._async_loop = None
 
-    def analyze(self, content_json, sfem_paths):
+    def build_prompt(self, content_json, sfem_paths, report=None):
         # 1. Prepare Data
-        # We slice sfem_paths[:60] to prevent overflowing the context window
-        sfem_str = json.dumps(list(sfem_paths)[:60], indent=2)
-        content_str = json.dumps(content_json, indent=2)
-        
+        # The builder ranks the evidence and keeps the prompt under max_prompt_chars
+        # (see prompt_builder); report, if given, is filled with what was kept
+        context = self.prompt_builder.build_context(content_json, sfem_paths, report)
+
         # 2. Construct the Prompt
         # This matches the structure we used in training (Instruction + Context)
-        user_message = f"""
-        Analyze this Office File for malware. Return JSON {{score, reason}}.
+        return INSTRUCTION + "\n" + context
 
-        CONTEXT 1: Structural Paths
-        {sfem_str}
+    def _chat_args(self, user_message):
+        return dict(
+            model=self.model,
+            messages=[{
+                'role': 'user',
+                'content': user_message
+            }],
+            # Optional: Force JSON mode if your version supports it, 
+            # but our Modelfile system prompt already handles this.
+            format='json'
+        )
 
-        CONTEXT 2: Extracted Content
-        {content_str}
-        """
+    def _chat(self, user_message):
+        """Blocking chat request with analyze_async's retry policy; the
+        client's timeout bounds each attempt. Raises once retries run out."""
+        metrics = get_metrics()
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.timer("llm"):
+                    return self._client.chat(**self._chat_args(user_message))
+            except self.RETRYABLE_ERRORS:
+                if attempt == self.retries:
+                    raise
+                metrics.inc("llm_retries_total")
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def _error_verdict(self, e):
+        return error_verdict(f"Ollama Connection Error: {str(e) or type(e).__name__}").to_json()
+
+    def _normalize(self, reply):
+        """The model's reply as a schema-checked verdict string. A reply that
+        can't be repaired into one becomes an error verdict (not cached, so
+        the file is retried)."""
+        metrics = get_metrics()
+        try:
+            verdict = parse_verdict(reply)
+        except VerdictError as e:
+            metrics.inc("errors_total", stage="verdict")
+            return error_verdict(f"Invalid model reply: {e}").to_json()
+        if verdict.repaired:
+            metrics.inc("verdict_repaired_total")
+        return verdict.to_json()
+
+    def _prompt_with_metrics(self, content_json, sfem_paths, report=None):
+        metrics = get_metrics()
+        with metrics.timer("prompt_build"):
+            user_message = self.build_prompt(content_json, sfem_paths, report)
+        metrics.observe("prompt_chars", len(user_message))
+        # Rough token count (~4 chars per token) - good enough for trends
+        metrics.observe("prompt_tokens_est", len(user_message) // 4)
+        return user_message
+
+    def analyze(self, content_json, sfem_paths, report=None):
+        user_message = self._prompt_with_metrics(content_json, sfem_paths, report)
+        metrics = get_metrics()
 
         try:
             # 3. Call Local Ollama Model
-            response = ollama.chat(
-                model=self.model,
-                messages=[{
-                    'role': 'user',
-                    'content': user_message
-                }],
-                # Optional: Force JSON mode if your version supports it, 
-                # but our Modelfile system prompt already handles this.
-                format='json' 
-            )
-            return response['message']['content']
+            response = self._chat(user_message)
+            return self._normalize(response['message']['content'])
             
         except Exception as e:
-            return json.dumps({
-                "score": -1.0, 
-                "reason": f"Ollama Connection Error: {str(e)}"
-            })
+            metrics.inc("errors_total", stage="llm")
+            return self._error_verdict(e)
+
+    def build_batch_prompt(self, contexts):
+        """One prompt for several documents: contexts is [(doc_id, context)]"""
+        sections = [f"\n=== DOCUMENT {doc_id} ==={context}" for doc_id, context in contexts]
+        return BATCH_INSTRUCTION + "\n" + "".join(sections)
+
+    def analyze_batch(self, items, reports=None):
+        """Verdicts for several (content_json, sfem_paths) pairs, in input order.
+
+        Each document gets a compact context (batch_doc_chars); they are
+        packed into as few requests as fit in max_prompt_chars, and each
+        request asks for a JSON array of verdicts keyed by document id. Any
+        document whose verdict is missing or malformed in the reply is
+        re-sent on its own with analyze(). reports, if given, is a list of
+        dicts filled like analyze()'s report (plus "batch": documents in the
+        request).
+        """
+        reports = reports if reports is not None else [{} for _ in items]
+        if len(items) == 1:
+            return [self.analyze(items[0][0], items[0][1], report=reports[0])]
+
+        metrics = get_metrics()
+        with metrics.timer("prompt_build"):
+            contexts = [self.batch_builder.build_context(content, paths, report)
+                        for (content, paths), report in zip(items, reports)]
+
+        # Greedy packing under the prompt budget, in input order
+        chunks, chunk, size = [], [], len(BATCH_INSTRUCTION) + 1
+        for i, context in enumerate(contexts):
+            cost = len(context) + 32
+            if chunk and size + cost > self.max_prompt_chars:
+                chunks.append(chunk)
+                chunk, size = [], len(BATCH_INSTRUCTION) + 1
+            chunk.append(i)
+            size += cost
+        chunks.append(chunk)
+
+        verdicts = [None] * len(items)
+        for chunk in chunks:
+            if len(chunk) == 1:
+                i = chunk[0]
+                verdicts[i] = self.analyze(items[i][0], items[i][1], report=reports[i])
+                continue
+
+            ids = {f"doc{n + 1}": i for n, i in enumerate(chunk)}
+            user_message = self.build_batch_prompt([(doc_id, contexts[i]) for doc_id, i in ids.items()])
+            metrics.observe("prompt_chars", len(user_message))
+            metrics.observe("prompt_tokens_est", len(user_message) // 4)
+            metrics.observe("llm_batch_size", len(chunk))
+            try:
+                response = self._chat(user_message)
+            except Exception as e:
+                # Server unreachable: single requests would fail the same way
+                metrics.inc("errors_total", stage="llm")
+                for i in chunk:
+                    verdicts[i] = self._error_verdict(e)
+                continue
+
+            parsed = parse_batch_verdicts(response['message']['content'], ids)
+            for doc_id, i in ids.items():
+                reports[i]["batch"] = len(chunk)
+                if doc_id in parsed:
+                    verdicts[i] = parsed[doc_id]
+                else:
+                    metrics.inc("llm_batch_fallback_total")
+                    reports[i].clear()
+                    verdicts[i] = self.analyze(items[i][0], items[i][1], report=reports[i])
+        return verdicts
+
+    def _get_async_client(self):
+        # httpx connection pools belong to one event loop, so keep one client per loop
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = ollama.AsyncClient(host=self.host)
+            self._async_loop = loop
+        return self._async_client
+
+    async def analyze_async(self, content_json, sfem_paths):
+        """Same result as analyze(), without blocking the event loop"""
+        user_message = self._prompt_with_metrics(content_json, sfem_paths)
+        client = self._get_async_client()
+        metrics = get_metrics()
+
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.timer("llm"):
+                    response = await asyncio.wait_for(
+                        client.chat(**self._chat_args(user_message)), self.timeout)
+                return self._normalize(response['message']['content'])
+
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == self.retries:
+                    metrics.inc("errors_total", stage="llm")
+                    return self._error_verdict(e)
+                metrics.inc("llm_retries_total")
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+
+            except Exception as e:
+                metrics.inc("errors_total", stage="llm")
+                return self._error_verdict(e)
+
+    async def analyze_many(self, items):
+        """Analyzes (content_json, sfem_paths) pairs concurrently, at most
+        `concurrency` requests at a time. Verdicts come back in input order."""
+        limit = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(content_json, sfem_paths):
+            async with limit:
+                return await self.analyze_async(content_json, sfem_paths)
+
+        return await asyncio.gather(*(run_one(c, p) for c, p in items))
 
 def main():
+    # Imported here: batch_scan imports this module for its pool workers
+    from batch_scan import BatchScanner, DEFAULT_QUEUE_DEPTH, list_files
+    from file_index import FileIndex, DEFAULT_INDEX_FILE
+    from llm_batch import DEFAULT_BATCH_SIZE, DEFAULT_MAX_WAIT
+    from pre_classifier import PreClassifier, DEFAULT_MODEL_FILE
+    from similarity_index import SimilarityIndex, DEFAULT_INDEX_FILE as DEFAULT_SIMILARITY_FILE, DEFAULT_THRESHOLD
+    from verdict_cache import VerdictCache, DEFAULT_CACHE_FILE, is_error_verdict
+    from verdicts import VerdictSink
+
     # Use dynamic path so it works on both Docker and Local
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
     PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
     DATA_DIR = os.path.join(PROJECT_ROOT, "data", "malware") 
     # ^ Changed to 'malware' folder for testing, or use 'benign'
 
+    parser = argparse.ArgumentParser("Model")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Folder of documents to scan")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes for the sieve/extraction stage (default: all cores)")
+    parser.add_argument("--queue-depth", type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help="Suspicious files allowed to wait for the model")
+    parser.add_argument("--inference-workers", type=int, default=1,
+                        help="Concurrent Ollama requests")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE,
+                        help="SQLite verdict cache keyed by SHA-256")
+    parser.add_argument("--no-cache", action="store_true", help="Re-analyze every file")
+    parser.add_argument("--metrics-out", help="Record per-stage metrics and write them here")
+    parser.add_argument("--metrics-format", choices=["prometheus", "jsonl"], default="prometheus")
+    parser.add_argument("--results-out", help="Append every result to this file, one JSON object per line")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only scan files that are new or changed since the last incremental run")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and scan files as they land in the folder (implies --incremental)")
+    parser.add_argument("--index", default=DEFAULT_INDEX_FILE, help="SQLite index used by --incremental")
+    parser.add_argument("--similarity", nargs="?", const=DEFAULT_SIMILARITY_FILE,
+                        help="Let near-duplicates of judged documents inherit their verdict "
+                             "(MinHash/LSH index, SQLite; default file when no path is given)")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Minimum estimated Jaccard similarity of the path sets")
+    parser.add_argument("--pre-classifier", nargs="?", const=DEFAULT_MODEL_FILE,
+                        help="Decide confident files with the structural pre-classifier "
+                             "(train it with 'python src/pre_classifier.py train')")
+    parser.add_argument("--defer-band", type=float, nargs=2, metavar=("LOW", "HIGH"),
+                        help="Pre-classifier probabilities between LOW and HIGH go to the AI")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Suspicious documents per Ollama request (1 = one request each)")
+    parser.add_argument("--batch-wait", type=float, default=DEFAULT_MAX_WAIT,
+                        help="Seconds a suspicious document waits for a batch to fill")
+    args = parser.parse_args()
+    DATA_DIR = args.data_dir
+
     analyst = LocalMalwareScanner()
     
     print(f"--- Local Malware Scanner (Ollama) ---")
@@ -127,34 +464,119 @@ def main():
         print("[-] Data directory not found.")
         return
 
-    for filename in os.listdir(DATA_DIR):
-        filepath = os.path.join(DATA_DIR, filename)
-        
-        # Skip directories
-        if os.path.isdir(filepath): continue
-
-        print(f"\n[?] Checking: {filename}")
-        
-        # 1. SFEM Analysis (The Sieve)
-        sfem_tool = SFEM_Analyzer(filepath)
-        if not sfem_tool.run_sieve():
-            print(f"    -> [CLEAN] Structure looks benign. Skipping AI.")
-            continue
-            
-        print(f"    -> [SUSPICIOUS] Sieve triggered! Sending to AI...")
-        
-        # 2. Extract Content
-        # (Assuming Office2JSON works; wrapping in try/except just in case)
-        try:
-            extractor = __create_json(filepath) 
-            evidence_json = extractor.run()
-        except Exception as e:
-            print(f"    -> [ERROR] Extraction failed: {e}")
-            continue
+    metrics = enable_metrics() if args.metrics_out else get_metrics()
+    cache = None if args.no_cache else VerdictCache(args.cache)
+    sink = VerdictSink(args.results_out) if args.results_out else None
+    similarity = SimilarityIndex(args.similarity, args.similarity_threshold) if args.similarity else None
+    pre_classifier = None
+    if args.pre_classifier:
+        pre_classifier = PreClassifier.load(args.pre_classifier, *(args.defer_band or (None, None)))
+        print(f"[*] Pre-classifier: {len(pre_classifier.paths)} paths, "
+              f"AI only for {pre_classifier.low:.2f} < p < {pre_classifier.high:.2f}")
+    scanner = BatchScanner(analyst, workers=args.workers, queue_depth=args.queue_depth,
+                           inference_workers=args.inference_workers, cache=cache, similarity=similarity,
+                           pre_classifier=pre_classifier, batch_size=args.batch_size, max_wait=args.batch_wait)
+    print(f"[*] Workers: {scanner.workers}, queue depth: {scanner.queue_depth}")
+
+    # Incremental: only files the index hasn't seen with this content, for this model and prompt
+    index = FileIndex(args.index) if args.incremental or args.watch else None
+    scope = f"Model:{analyst.model}:{analyst.PROMPT_VERSION}"
+    if index is None:
+        batches = [list_files(DATA_DIR)]
+    elif args.watch:
+        print(f"[*] Watching {DATA_DIR} (Ctrl+C to stop)")
+        batches = index.watch(DATA_DIR, scope)
+    else:
+        batches = [list(index.changes(DATA_DIR, scope))]
+
+    # 1. SFEM Analysis (The Sieve) and 2. Content Extraction run in the pool,
+    # 3. Ollama runs alongside; results are printed as they finish
+    tiers = {}
+    decisions = {}
+    try:
+        with metrics.timer("scan_total"):
+            for batch in batches:
+                changes = {}
+                if index is not None:
+                    # FileChanges keep the stat + hash from the diff; marked once the file has a verdict
+                    changes = {change.path: change for change in batch}
+                    batch = list(changes)
+                    print(f"[*] {len(batch)} new or changed file(s)")
+                for result in scanner.scan(batch):
+                    print(f"\n[?] Checked: {os.path.basename(result['file'])}")
+                    if result.get("cached"):
+                        print(f"    -> [CACHED] Seen before (sha256 {result['sha256'][:12]}...)")
+                    elif result.get("tier") is not None:
+                        key = (result["tier"], "flagged" if result["suspicious"] else "clean")
+                        tiers[key] = tiers.get(key, 0) + 1
+
+                    for limit, part in (result.get("limits") or {}).items():
+                        print(f"    -> [LIMIT] {limit} cap reached in {part}; structure is partial")
+                    if result.get("resource_limit"):
+                        print(f"    -> [RESOURCE LIMIT] {result['resource_limit']['limit']}: "
+                              f"{result['resource_limit']['detail']}. Not sent to the AI.")
+                        print(f"    -> VERDICT: {result['verdict']}")
+                    elif result["error"]:
+                        print(f"    -> [ERROR] Extraction failed: {result['error']}")
+                    elif not result["suspicious"]:
+                        print(f"    -> [CLEAN] Structure looks benign. Skipping AI. (sieve tier {result.get('tier')})")
+                    else:
+                        print(f"    -> [SUSPICIOUS] Sieve triggered on '{result.get('trigger')}' (tier {result.get('tier')})")
+                        pre = result.get("pre_classifier")
+                        if pre:
+                            decisions[pre["decision"]] = decisions.get(pre["decision"], 0) + 1
+                            if pre["decision"]:
+                                print(f"    -> [PRE-CLASSIFIER] p(malicious)={pre['p']:.3f}: {pre['decision']}. AI skipped.")
+                            else:
+                                print(f"    -> [PRE-CLASSIFIER] p(malicious)={pre['p']:.3f}: uncertain, deferred")
+                        similar = result.get("similar_to")
+                        if similar:
+                            print(f"    -> [SIMILAR] {similar['similarity']:.0%} like {similar['sha256'][:12]}... "
+                                  f"({similar['members']} in cluster). Verdict inherited, AI skipped.")
+                        prompt = result.get("prompt")
+                        if prompt:
+                            print(f"    -> Prompt: ~{prompt['tokens_est']} tokens, "
+                                  f"{prompt['parts_included']} parts ({prompt['parts_summarized']} summarized, "
+                                  f"{prompt['parts_dropped']} dropped), "
+                                  f"{prompt['paths_included']}/{prompt['paths_total']} paths"
+                                  + (f", in a batch of {prompt['batch']}" if prompt.get("batch") else ""))
+                        print(f"    -> AI VERDICT: {result['verdict']}")
+                    if sink is not None:
+                        sink.write(result)
+                    # A refusal is settled for this content; other error verdicts are retried next run
+                    done = not is_error_verdict(result["verdict"]) or result.get("resource_limit")
+                    if result["file"] in changes and not result["error"] and done:
+                        index.mark(scope, changes[result["file"]])
+                if index is not None:
+                    index.flush()
+                if sink is not None:
+                    sink.flush()
+    except KeyboardInterrupt:
+        print("\n[*] Stopped")
+
+    print("\n--- Sieve tiers ---")
+    for (tier, outcome), count in sorted(tiers.items()):
+        print(f"[*] Tier {tier} {outcome}: {count}")
+
+    if pre_classifier is not None:
+        scored = sum(decisions.values())
+        deferred = decisions.get(None, 0)
+        print("\n--- Pre-classifier ---")
+        print(f"[*] Scored {scored}: {decisions.get('malicious', 0)} malicious, {decisions.get('clean', 0)} clean, "
+              f"{deferred} deferred to the AI (deferral rate {deferred / scored if scored else 0:.1%})")
 
-        # 3. Analyze with Ollama
-        verdict_str = analyst.analyze(evidence_json, sfem_tool.unique_paths)
-        print(f"    -> AI VERDICT: {verdict_str}")
+    if sink is not None:
+        sink.close()
+        print(f"[+] {sink.written} results written to {args.results_out}")
+    if cache is not None:
+        cache.close()
+    if similarity is not None:
+        similarity.close()
+    if index is not None:
+        index.close()
+    if args.metrics_out:
+        metrics.write(args.metrics_out, args.metrics_format)
+        print(f"[+] Metrics written to {args.metrics_out}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
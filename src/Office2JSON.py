@@ -1,10 +1,17 @@
-import shutil
+import errno
+import io
+import mmap
+import struct
 import zipfile
+import zlib
 import os
 import argparse
-import subprocess
 import json
 import time
+from collections.abc import Mapping
+
+from metrics import get_metrics
+from resource_limits import DEFAULT_LIMITS, ArchiveBudget, ResourceLimitExceeded, check_directory
 
 
 def __create_json(folder_path):
@@ -30,65 +37,371 @@ def read_file_content(path, file_name):
     file_path = os.path.join(path, file_name)
 
     if file_path.endswith((".xml", ".rels")):
-        with open(file_path, encoding="utf-8", errors="ignore") as f:
-            return f.read().replace('"', "'")
+        with get_metrics().timer("part_content", kind="xml"):
+            with open(file_path, "rb") as f:
+                return _part_text(f.read())
 
     elif file_path.endswith("vbaProject.bin"):
-        try:
-            output = subprocess.check_output(
-                ["olevba", "--json", file_path],
-                stderr=subprocess.DEVNULL
-            ).decode("utf-8")
+        with get_metrics().timer("part_content", kind="vba"):
+            return _olevba_json(file_path)
 
-            start = output.find("{")
-            end = output.rfind("}") + 1
-            return json.loads(output[start:end])
+    return read_part_content(file_path, b"")
 
-        except Exception:
-            return ""
 
-    elif file_path.lower().endswith((".png", ".jpg", ".jpeg")):
+def part_has_content(name):
+    """True for the part types whose bytes end up in the JSON (XML and VBA)"""
+    return name.endswith((".xml", ".rels", "vbaProject.bin"))
+
+
+def read_part_content(name, data):
+    """Same as read_file_content, but for a zip member already read into memory.
+
+    ``data`` is only looked at when part_has_content(name) is True, so callers
+    can pass b"" for images and other parts without inflating them.
+    """
+    if name.endswith((".xml", ".rels")):
+        with get_metrics().timer("part_content", kind="xml"):
+            return _part_text(data)
+
+    elif name.endswith("vbaProject.bin"):
+        with get_metrics().timer("part_content", kind="vba"):
+            return _olevba_json(os.path.basename(name), bytes(data))
+
+    elif name.lower().endswith((".png", ".jpg", ".jpeg")):
         return ""
 
-    elif file_path.endswith(".vml"):
+    elif name.endswith(".vml"):
         return "*vector markup language file*"
 
     else:
         return "*file type unknown, raise suspicion!*"
 
 
-def extract(file_path):
-    abs_path = os.path.abspath(file_path)
-    base_dir = os.path.dirname(abs_path)
-    file_name = os.path.basename(abs_path)
+def _part_text(data):
+    """XML bytes (or any buffer) -> text the way a text-mode open() reads it:
+    utf-8 with errors ignored, universal newlines; then " -> '.
+    Each step only copies the text when it has something to change."""
+    text = str(data, "utf-8", errors="ignore")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.replace('"', "'")
+
+
+def insert_part(data, name, value):
+    """Places a zip member into the nested dict the way __create_json lays out folders"""
+    parts = name.split("/")
+
+    curr = data
+    for part in parts[:-1]:
+        if part:
+            curr = curr.setdefault(part, {})
+
+    if parts[-1]:
+        curr[parts[-1]] = value
+
+
+_olevba = None
+
+
+def _get_olevba():
+    """Imports oletools.olevba on first use; every later call in this process reuses it"""
+    global _olevba
+    if _olevba is None:
+        from oletools import olevba
+        _olevba = olevba
+    return _olevba
+
+
+def _olevba_json(file_name, data=None):
+    """What 'olevba --json' reports for one file, computed in-process.
+
+    Pass data to analyse bytes already in memory (file_name is then only the
+    label); with data=None file_name is read from disk.
+    """
+    try:
+        parser = _get_olevba().VBA_Parser_CLI(file_name, data=data)
+        try:
+            return parser.process_file_json()
+        finally:
+            parser.close()
+
+    except Exception:
+        return ""
+
+
+class _MappedFile:
+    """mmap has no seekable() before Python 3.13, which ZipFile asks for"""
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=0):
+        # mmap raises ValueError where zipfile expects a file's OSError
+        try:
+            return self.mapped.seek(pos, whence)
+        except ValueError as e:
+            raise OSError(errno.EINVAL, str(e)) from None
+
+    def __getattr__(self, name):
+        return getattr(self.mapped, name)
+
+
+def open_zip(source):
+    """ZipFile over a path, a bytes-like buffer, or an open binary file / mmap"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif isinstance(source, mmap.mmap):
+        source = _MappedFile(source)
+    return zipfile.ZipFile(source, "r")
+
+
+MEMBER_CHUNK = 256 * 1024  # bytes inflated per read when a whole member is wanted
+
+
+class _ViewReader:
+    """Stream over a memoryview, for stored members read straight from the map"""
+
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def read(self, n=-1):
+        end = len(self.view) if n is None or n < 0 else min(self.pos + n, len(self.view))
+        data = bytes(self.view[self.pos:end])
+        self.pos = end
+        return data
 
-    temp_zip = os.path.join(base_dir, os.path.splitext(file_name)[0] + ".zip")
-    temp_dir = os.path.join(base_dir, "temp_extraction")
+    def tell(self):
+        return self.pos
 
-    shutil.copy(abs_path, temp_zip)
+    def close(self):
+        self.view.release()
 
-    with zipfile.ZipFile(temp_zip, "r") as z:
-        z.extractall(temp_dir)
+    def __enter__(self):
+        return self
 
-    os.remove(temp_zip)
+    def __exit__(self, *exc):
+        self.close()
+        return False
 
-    json_dict = __create_json(temp_dir)
+
+class ZipDocument(Mapping):
+    """Read-only view of a package: member name -> bytes, inflated on access.
+
+    Opening one only reads the central directory (refused up front if it
+    declares more than the decompression caps allow). A path is mapped with
+    mmap, so stored (uncompressed) members are served as memoryviews of the
+    map without being copied; deflated members are inflated under an
+    ArchiveBudget. Only what is accessed is ever read:
+
+        with ZipDocument("invoice.docm") as doc:
+            head = doc.prefix("word/document.xml", 4096)   # inflates 4 KiB
+            with doc.open("word/vbaProject.bin") as stream:
+                ...
+            content = doc.content()   # extract_json's nested dict, lazily
+
+    Directory entries are not members. Use it from one thread.
+    """
+
+    def __init__(self, source, limits=DEFAULT_LIMITS):
+        self.source = source
+        self.limits = limits
+        self._file = self._map = self._view = None
+        try:
+            if isinstance(source, (str, os.PathLike)):
+                self._file = open(source, "rb")
+                if os.fstat(self._file.fileno()).st_size == 0:
+                    raise zipfile.BadZipFile("File is empty")
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+                self._zip = open_zip(self._map)
+            else:
+                if isinstance(source, (bytes, bytearray, memoryview)):
+                    self._view = memoryview(source)
+                self._zip = open_zip(source)
+            check_directory(self._zip.infolist(), limits)
+        except Exception:
+            self.close()
+            raise
+
+        self._infos = {info.filename: info for info in self._zip.infolist() if not info.is_dir()}
+        self.budget = ArchiveBudget(limits)
+
+    def info(self, name):
+        return self._infos[name]
+
+    def infolist(self):
+        """Every entry of the central directory, directories included"""
+        return self._zip.infolist()
+
+    def _stored_range(self, info):
+        """(start, end) of a stored member's bytes in the view, or None when
+        it has to go through zipfile (deflated, encrypted, not mapped)"""
+        if (self._view is None or info.compress_type != zipfile.ZIP_STORED
+                or info.flag_bits & 0x1 or info.compress_size != info.file_size):
+            return None
+        header = self._view[info.header_offset:info.header_offset + 30]
+        if len(header) < 30 or header[:4] != b"PK\x03\x04":
+            return None
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        start = info.header_offset + 30 + name_len + extra_len
+        end = start + info.file_size
+        return (start, end) if end <= len(self._view) else None
+
+    def open(self, name):
+        """Streaming reader over one member (read(n), tell(), close())"""
+        info = self._infos[name]
+        span = self._stored_range(info)
+        if span is None:
+            return self.budget.open(self._zip, info)
+        self.budget.charge(info, info.file_size, info.file_size)
+        return _ViewReader(self._view[span[0]:span[1]])
+
+    def prefix(self, name, n):
+        """At most the first n bytes of a member; only those are inflated"""
+        info = self._infos[name]
+        span = self._stored_range(info)
+        if span is not None:
+            return self._view[span[0]:min(span[0] + n, span[1])]
+        with self.budget.open(self._zip, info) as stream:
+            return stream.read(n)
+
+    def __getitem__(self, name):
+        """The whole member: a memoryview of the map for stored members
+        (CRC checked), a bytearray otherwise"""
+        info = self._infos[name]
+        span = self._stored_range(info)
+        if span is None:
+            # Grown in place rather than joined from chunks: one copy of the member at a time
+            data = bytearray()
+            with self.budget.open(self._zip, info) as stream:
+                for chunk in iter(lambda: stream.read(MEMBER_CHUNK), b""):
+                    data += chunk
+            return data
+        view = self._view[span[0]:span[1]]
+        if zlib.crc32(view) != info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {name!r}")
+        self.budget.charge(info, info.file_size, info.file_size)
+        return view
+
+    def __iter__(self):
+        return iter(self._infos)
+
+    def __len__(self):
+        return len(self._infos)
+
+    def text(self, name, limit=None):
+        """read_part_content() of a member, from at most `limit` bytes of it"""
+        if not part_has_content(name):
+            return read_part_content(name, b"")
+        return read_part_content(name, self[name] if limit is None else self.prefix(name, limit))
+
+    def content(self):
+        """extract_json's nested dict as a lazy mapping over this document"""
+        tree = {}
+        for info in self.infolist():
+            insert_part(tree, info.filename, None if info.is_dir() else info.filename)
+        return LazyContent(self, tree)
+
+    def close(self):
+        if getattr(self, "_zip", None) is not None:
+            self._zip.close()
+        if self._view is not None:
+            self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # a caller still holds a member's view; the map goes when it does
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class LazyContent(Mapping):
+    """Same layout and values as extract_json's dict, but a part is read and
+    converted (read_part_content) each time it is looked up, and not kept.
+    Folders are LazyContent too."""
+
+    def __init__(self, document, tree):
+        self.document = document
+        self._tree = tree
+
+    def __getitem__(self, key):
+        value = self._tree[key]
+        if isinstance(value, dict):
+            return LazyContent(self.document, value)
+        return None if value is None else self.document.text(value)
+
+    def __iter__(self):
+        return iter(self._tree)
+
+    def __len__(self):
+        return len(self._tree)
+
+
+def extract_json(source, limits=DEFAULT_LIMITS):
+    """Builds the same nested dict as __create_json, reading members straight
+    from the zip. Nothing is copied or extracted to disk, so concurrent runs
+    on the same directory no longer share a temp_extraction folder.
+
+    Members are inflated as streams under the decompression caps in limits;
+    a package over them raises resource_limits.ResourceLimitExceeded.
+    """
+    data = {}
+
+    with ZipDocument(source, limits) as doc:
+        for info in doc.infolist():
+            if info.is_dir():
+                insert_part(data, info.filename, None)
+            else:
+                insert_part(data, info.filename, doc.text(info.filename))
+
+    return data
+
+
+def extract(file_path):
+    abs_path = os.path.abspath(file_path)
+    base_dir = os.path.dirname(abs_path)
+    file_name = os.path.basename(abs_path)
+
+    json_dict = extract_json(abs_path)
 
     out_file = os.path.join(base_dir, f"extracted_{file_name}.json")
     with open(out_file, "w", encoding="utf-8") as f:
         json.dump(json_dict, f, indent=4)
 
-    shutil.rmtree(temp_dir)
-
 
 if __name__ == "__main__":
     start = time.time()
 
     parser = argparse.ArgumentParser("Office2JSON")
     parser.add_argument("file", help="Path to .docx/.xlsx file")
+    parser.add_argument("--part", help="Only print this member's content (e.g. word/document.xml)")
+    parser.add_argument("--head", type=int, default=None, help="With --part: read at most this many bytes")
     args = parser.parse_args()
 
-    extract(args.file)
+    try:
+        if args.part:
+            with ZipDocument(args.file) as doc:
+                if args.part not in doc:
+                    print(f"[-] No member {args.part}")
+                    raise SystemExit(1)
+                print(doc.text(args.part, args.head))
+            raise SystemExit(0)
+        extract(args.file)
+    except ResourceLimitExceeded as e:
+        print(f"[-] Refused: {e}")
+        raise SystemExit(2)
 
     print("_" * 40)
     print(f"Extraction time:\t{round(time.time() - start, 3)}s")
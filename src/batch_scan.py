@@ -0,0 +1,322 @@
+"""Parallel batch scanning for Model.main.
+
+The sieve and the content extraction are CPU-bound, so they are fanned out
+over a ProcessPoolExecutor. Suspicious files are handed to the Ollama stage
+through a bounded queue, so inference runs while the pool keeps parsing;
+when the queue is full the feeder stops submitting new files until the
+model catches up. Results are yielded as soon as each file is finished.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from Model import SFEM_Analyzer, LocalMalwareScanner, resource_limit_verdict
+from llm_batch import DEFAULT_BATCH_SIZE, DEFAULT_MAX_WAIT, collect
+from metrics import Metrics, get_metrics, set_metrics
+from verdict_cache import calculate_sha256
+from verdicts import error_verdict
+
+DEFAULT_QUEUE_DEPTH = 16
+
+_DONE = object()
+
+
+class _Failed:
+    """Put on the output queue when the feeder itself dies; scan() re-raises it"""
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _error_result(path, e):
+    return {"file": path, "suspicious": False, "verdict": None, "error": str(e) or type(e).__name__}
+
+
+def prepare_file(filepath, collect_metrics=False, name=None):
+    """Runs in a pool worker: the sieve, then (suspicious files only) one
+    full pass for the paths and content the model needs.
+
+    filepath may be the document's bytes instead; pass name to label the
+    result (it is reported as result["file"]).
+
+    With collect_metrics the worker records into a private registry and
+    returns its snapshot in result["metrics"] for the parent to merge.
+    """
+    previous = set_metrics(Metrics()) if collect_metrics else None
+    try:
+        result = _prepare(filepath, name)
+    finally:
+        if collect_metrics:
+            result_metrics = get_metrics().snapshot()
+            set_metrics(previous)
+    if collect_metrics:
+        result["metrics"] = result_metrics
+    return result
+
+
+def _prepare(filepath, name=None):
+    result = {"file": name or filepath, "suspicious": False, "verdict": None, "error": None}
+
+    with get_metrics().timer("prepare"):
+        sfem = SFEM_Analyzer(filepath)
+        result["suspicious"] = sfem.run_sieve()
+        result["tier"] = sfem.tier
+        result["paths"] = []
+
+        if result["suspicious"] and sfem.resource_limit is None:
+            result["trigger"] = sfem.trigger
+            sfem.extract_structure(with_content=True)
+            if sfem.content is None and sfem.resource_limit is None:
+                result["error"] = "no content extracted"
+            result["content"] = sfem.content
+            result["paths"] = sorted(sfem.unique_paths)
+
+        # Parsing caps that fired in the sieve or the extraction (limit -> part)
+        result["limits"] = sfem.limits
+
+        # Refused by the decompression caps: the verdict is decided here, not by the model
+        if sfem.resource_limit is not None:
+            result["resource_limit"] = sfem.resource_limit
+            result["verdict"] = resource_limit_verdict(sfem.resource_limit)
+            result.pop("content", None)
+
+    return result
+
+
+def pre_classify(clf, result):
+    """Scores a suspicious result with the PreClassifier; True when it decided
+    the verdict (result["pre_classifier"] records the probability either way)"""
+    if clf is None:
+        return False
+    p, decision = clf.decide(result["paths"])
+    result["pre_classifier"] = {"p": round(p, 4), "decision": decision}
+    get_metrics().inc("pre_classifier_total", decision=decision or "deferred")
+    if decision is None:
+        return False
+    result["verdict"] = clf.verdict(result["paths"], p, decision)
+    result.pop("content", None)
+    return True
+
+
+def cacheable(result):
+    """False for verdicts the model didn't give (pre-classifier decisions,
+    inherited from a near-duplicate): the cache key is the model's, and a run
+    without those options must not be served their guesses"""
+    if result.get("similar_to"):
+        return False
+    return not (result.get("pre_classifier") or {}).get("decision")
+
+
+class BatchScanner:
+    """Scans many files with a process pool feeding one or more Ollama threads.
+
+    workers:            processes for the sieve/extraction stage (default: all cores)
+    queue_depth:        suspicious files allowed to wait for the model
+    inference_workers:  concurrent Ollama requests
+    cache:              optional VerdictCache; hits skip the pool and the model
+    similarity:         optional SimilarityIndex; near-duplicates of a document
+                        the model already judged inherit its verdict
+    pre_classifier:     optional PreClassifier; suspicious files it is confident
+                        about get its verdict, only the uncertain band reaches the model
+    batch_size:         documents per model request (see llm_batch; 1 = one each)
+    max_wait:           seconds a document waits for a batch to fill
+    """
+
+    def __init__(self, analyst=None, workers=None, queue_depth=DEFAULT_QUEUE_DEPTH,
+                 inference_workers=1, cache=None, similarity=None, pre_classifier=None,
+                 batch_size=DEFAULT_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+        self.analyst = analyst or LocalMalwareScanner()
+        self.cache = cache
+        self.similarity = similarity
+        self.pre_classifier = pre_classifier
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_depth = max(1, queue_depth)
+        self.inference_workers = max(1, inference_workers)
+
+    def _feed(self, filepaths, infer_q, out_q):
+        """Submits files to the pool, keeping at most workers + queue_depth in flight"""
+        max_in_flight = self.workers + self.queue_depth
+        metrics = get_metrics()
+        in_flight = {}
+        files = iter(filepaths)
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                exhausted = False
+                while in_flight or not exhausted:
+                    while not exhausted and len(in_flight) < max_in_flight:
+                        path = next(files, None)
+                        if path is None:
+                            exhausted = True
+                            break
+
+                        sha256 = None
+                        if self.cache is not None:
+                            try:
+                                cached = self._lookup(path)
+                            except Exception as e:
+                                metrics.inc("errors_total", stage="cache")
+                                out_q.put(_error_result(path, e))
+                                continue
+                            if cached.get("cached"):
+                                out_q.put(cached)
+                                continue
+                            sha256 = cached.get("sha256")
+
+                        future = pool.submit(prepare_file, path, metrics.enabled)
+                        in_flight[future] = (path, sha256)
+
+                    if not in_flight:
+                        break
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path, sha256 = in_flight.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = _error_result(path, e)
+                        metrics.merge(result.pop("metrics", None))
+                        result["sha256"] = sha256
+                        result["cached"] = False
+
+                        try:
+                            to_model = (result["suspicious"] and not result["error"]
+                                        and result["verdict"] is None
+                                        and not pre_classify(self.pre_classifier, result)
+                                        and not self._inherit(result))
+                        except Exception as e:
+                            # A broken pre-classifier or index costs this file its verdict, not the run
+                            metrics.inc("errors_total", stage="feed")
+                            result.pop("content", None)
+                            result["verdict"] = None
+                            result["error"] = str(e) or type(e).__name__
+                            to_model = False
+
+                        if to_model:
+                            # Blocks while the model is behind: that's the backpressure
+                            infer_q.put(result)
+                        else:
+                            if not result["error"]:
+                                self._store(result)
+                            out_q.put(result)
+        except BaseException as e:
+            out_q.put(_Failed(e))
+        finally:
+            for _ in range(self.inference_workers):
+                infer_q.put(_DONE)
+
+    def _infer(self, infer_q, out_q):
+        try:
+            while True:
+                result = infer_q.get()
+                if result is _DONE:
+                    return
+
+                # Wait up to max_wait for more suspicious files to share the request
+                batch, stopped = collect(infer_q, result, self.batch_size, self.max_wait, _DONE)
+                self._judge(batch, out_q)
+                if stopped:
+                    return
+        finally:
+            # scan() counts these; without it a crash here would leave it waiting forever
+            out_q.put(_DONE)
+
+    def _judge(self, batch, out_q):
+        """Model verdicts for a batch; failures become error verdicts, never exceptions"""
+        for result in batch:
+            result["prompt"] = {}
+        try:
+            verdicts = self.analyst.analyze_batch([(r.pop("content", None), r["paths"]) for r in batch],
+                                                  reports=[r["prompt"] for r in batch])
+        except Exception as e:
+            get_metrics().inc("errors_total", stage="llm")
+            verdicts = [error_verdict(f"Inference failed: {str(e) or type(e).__name__}").to_json()] * len(batch)
+
+        for result, verdict in zip(batch, verdicts):
+            result["verdict"] = verdict
+            self._store(result, index=True)
+            out_q.put(result)
+
+    def _inherit(self, result):
+        """Takes the verdict of a near-duplicate the model already judged; True on a match"""
+        if self.similarity is None:
+            return False
+        match = self.similarity.query(result["paths"], self.analyst.model, self.analyst.PROMPT_VERSION)
+        get_metrics().inc("similarity_total", result="miss" if match is None else "hit")
+        if match is None:
+            return False
+        from similarity_index import inherit  # numpy; kept out of the pool workers' imports
+        inherit(result, match)
+        result.pop("content", None)
+        return True
+
+    def _lookup(self, path):
+        """Hashes the file and checks the cache; returns a full result on a hit"""
+        try:
+            sha256 = calculate_sha256(path)
+        except OSError:
+            return {}
+
+        hit = self.cache.get(sha256, self.analyst.model, self.analyst.PROMPT_VERSION)
+        get_metrics().inc("cache_total", result="miss" if hit is None else "hit")
+        if hit is None:
+            return {"sha256": sha256}
+
+        hit.update({"file": path, "sha256": sha256, "error": None, "cached": True})
+        return hit
+
+    def _store(self, result, index=False):
+        """Caches the result (and with index=True adds it to the similarity
+        index). A failure here is recorded in result["error"]: the verdict
+        stands, the file just isn't remembered."""
+        try:
+            if index and self.similarity is not None:
+                self.similarity.add(result.get("sha256") or calculate_sha256(result["file"]), result["paths"],
+                                    self.analyst.model, self.analyst.PROMPT_VERSION, result["verdict"])
+            if self.cache is not None and result.get("sha256") and cacheable(result):
+                self.cache.put(result["sha256"], self.analyst.model, self.analyst.PROMPT_VERSION,
+                               result["suspicious"], result.get("paths"), result["verdict"])
+        except Exception as e:
+            get_metrics().inc("errors_total", stage="store")
+            result["error"] = f"Storing the verdict failed: {str(e) or type(e).__name__}"
+
+    def scan(self, filepaths):
+        """Yields one result dict per file, in completion order; re-raises
+        whatever stopped the feeder itself (per-file failures are error results)"""
+        infer_q = queue.Queue(maxsize=self.queue_depth)
+        out_q = queue.Queue()
+
+        threads = [threading.Thread(target=self._feed, args=(filepaths, infer_q, out_q), daemon=True)]
+        for _ in range(self.inference_workers):
+            threads.append(threading.Thread(target=self._infer, args=(infer_q, out_q), daemon=True))
+        for t in threads:
+            t.start()
+
+        metrics = get_metrics()
+        finished = 0
+        while finished < self.inference_workers:
+            result = out_q.get()
+            if result is _DONE:
+                finished += 1
+                continue
+            if isinstance(result, _Failed):
+                raise result.exc
+            outcome = "error" if result["error"] else "suspicious" if result["suspicious"] else "clean"
+            metrics.inc("files_total", outcome=outcome)
+            yield result
+
+        for t in threads:
+            t.join()
+
+
+def list_files(data_dir):
+    """Regular files directly inside data_dir (no recursion, like Model.main).
+    Hidden files are skipped, like FileIndex does: the downloader writes its
+    in-progress archives there as dot-files."""
+    for entry in os.scandir(data_dir):
+        if not entry.name.startswith('.') and entry.is_file():
+            yield entry.path
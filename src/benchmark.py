@@ -0,0 +1,205 @@
+"""Benchmark the scan pipeline stages over the samples in data/.
+
+Each stage runs over every file in its own fresh process, so the peak RSS
+reported for a stage is that stage's alone. Per stage we report files/s,
+MB/s (input file bytes), p50/p95/p99/max latency and peak RSS, and write
+everything as JSON so runs can be compared:
+
+    python src/benchmark.py --output bench.json
+    python src/benchmark.py --output new.json --compare bench.json
+
+The LLM stage talks to ollama_stub, so no model server is needed.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(PROJECT_ROOT, "data")
+
+DIRS = {
+    "Malicious": os.path.join(DATA_DIR, "malware"),
+    "Benign": os.path.join(DATA_DIR, "benign"),
+}
+
+STAGES = ["extract_structure", "run_sieve", "content", "prompt", "training_entry", "llm_stub"]
+
+
+def list_samples(limit=None):
+    """(path, label) for every file in data/malware and data/benign"""
+    samples = []
+    for label, folder in DIRS.items():
+        if not os.path.isdir(folder):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            filepath = os.path.join(folder, filename)
+            if os.path.isfile(filepath):
+                samples.append((filepath, label))
+    return samples[:limit] if limit else samples
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _make_stage(stage):
+    """Returns (prepare, run): prepare(path, label) is untimed setup, run(prepared) is timed"""
+    from Model import SFEM_Analyzer, LocalMalwareScanner
+    from Office2JSON import extract_json
+
+    def full_scan(path, label):
+        sfem = SFEM_Analyzer(path)
+        paths = sfem.extract_structure(with_content=True)
+        return sfem.content or {}, paths
+
+    if stage == "extract_structure":
+        return (lambda path, label: path), (lambda path: SFEM_Analyzer(path).extract_structure())
+
+    if stage == "run_sieve":
+        return (lambda path, label: path), (lambda path: SFEM_Analyzer(path).run_sieve())
+
+    if stage == "content":
+        return (lambda path, label: path), extract_json
+
+    if stage == "prompt":
+        scanner = LocalMalwareScanner()
+        return full_scan, (lambda prepared: scanner.build_prompt(*prepared))
+
+    if stage == "training_entry":
+        from build_dataset import generate_training_entry
+        return (lambda path, label: (path, label)), (lambda prepared: generate_training_entry(*prepared))
+
+    if stage == "llm_stub":
+        from ollama_stub import start_stub_server
+        server = start_stub_server()
+        scanner = LocalMalwareScanner(host=server.url)
+        return full_scan, (lambda prepared: scanner.analyze(*prepared))
+
+    raise ValueError(f"unknown stage {stage}")
+
+
+def _run_stage(stage, samples):
+    """Runs in a fresh process: times one stage over all samples"""
+    prepare, run = _make_stage(stage)
+    latencies = []
+    errors = 0
+    total_bytes = 0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for path, label in samples:
+            total_bytes += os.path.getsize(path)
+            try:
+                prepared = prepare(path, label)
+            except Exception:
+                prepared = None
+
+            start = time.perf_counter()
+            try:
+                if prepared is None:
+                    raise ValueError("setup failed")
+                run(prepared)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+    seconds = sum(latencies)
+    latencies.sort()
+    return {
+        "files": len(samples),
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "files_per_s": round(len(samples) / seconds, 2) if seconds else 0.0,
+        "mb_per_s": round(total_bytes / (1024 * 1024) / seconds, 2) if seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "peak_rss_mb": round(peak_mb, 1),
+    }
+
+
+def run_benchmark(stages=STAGES, limit=None):
+    samples = list_samples(limit)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "files": len(samples),
+        "input_mb": round(sum(os.path.getsize(p) for p, _ in samples) / (1024 * 1024), 2),
+        "stages": {},
+    }
+
+    ctx = multiprocessing.get_context("spawn")
+    for stage in stages:
+        print(f"[*] {stage} over {len(samples)} files...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            report["stages"][stage] = pool.submit(_run_stage, stage, samples).result()
+        s = report["stages"][stage]
+        print(f"    -> {s['files_per_s']} files/s, {s['mb_per_s']} MB/s, "
+              f"p50 {s['p50_ms']} ms, p99 {s['p99_ms']} ms, peak {s['peak_rss_mb']} MB")
+
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Prints per-stage p50/throughput ratios; returns the stages that got slower than tolerance"""
+    regressions = []
+    print(f"\n--- Compared to {baseline.get('timestamp', 'baseline')} ---")
+    if baseline.get("files") != report["files"]:
+        print(f"[!] Sample sets differ ({baseline.get('files')} vs {report['files']} files)")
+    for stage, new in report["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if not old or not old["p50_ms"] or not new["files_per_s"]:
+            continue
+        p50_ratio = new["p50_ms"] / old["p50_ms"]
+        tput_ratio = old["files_per_s"] / new["files_per_s"]
+        flag = ""
+        if max(p50_ratio, tput_ratio) > tolerance:
+            regressions.append(stage)
+            flag = "  <-- REGRESSION"
+        print(f"[*] {stage}: p50 x{p50_ratio:.2f}, time x{tput_ratio:.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, SCRIPT_DIR)
+
+    parser = argparse.ArgumentParser("benchmark")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N samples")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.2,
+                        help="Slowdown factor that counts as a regression")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.stages, args.limit)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[+] Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(report, json.load(f), args.tolerance):
+                sys.exit(1)
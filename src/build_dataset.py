@@ -1,9 +1,13 @@
 import os
 import json
 import csv
-import hashlib
-from Office2JSON import __create_json
-from Model import SFEM_Analyzer 
+import argparse
+import shutil
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from Model import SFEM_Analyzer, LocalMalwareScanner, INSTRUCTION
+from prompt_builder import PromptBuilder
+from dataset_shards import ShardedDataset, DEFAULT_SHARD_SIZE
+from verdict_cache import calculate_sha256
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -14,33 +18,30 @@ PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
 DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 LABELS_FILE = os.path.join(DATA_DIR, "labels.csv")
 OUTPUT_FILE = os.path.join(DATA_DIR, "training_dataset.jsonl")
+SHARD_DIR = os.path.join(DATA_DIR, "training_shards")
 
-def calculate_sha256(filepath):
-    """Helper to verify we are matching the correct file from CSV"""
-    sha256_hash = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
+# Entries built with another prompt format are rebuilt
+FEATURE_VERSION = LocalMalwareScanner.PROMPT_VERSION
+
+# Same budget and ranking as LocalMalwareScanner, so training inputs look like inference inputs
+PROMPT_BUILDER = PromptBuilder()
 
 def generate_training_entry(filepath, label):
     # --- PHASE 1: FEATURE EXTRACTION (SFEM) ---
     # This is where we convert the binary zip into the "Unique Path List"
+    # The same pass also collects the content for phase 2
     sfem = SFEM_Analyzer(filepath)
-    sfem_paths = sfem.extract_structure()
+    sfem_paths = sfem.extract_structure(with_content=True)
     
     # --- PHASE 2: CONTENT EXTRACTION ---
     # This gets the VBA code and relationships
-    content_json = __create_json(filepath)
+    content_json = sfem.content or {}
     # --- PHASE 3: FORMATTING FOR LLM ---
-    # We combine both features into the prompt
-    user_prompt = f"""
-    CONTEXT 1: Structural Paths
-    {json.dumps(sfem_paths[:60], indent=2)}
-
-    CONTEXT 2: Extracted Content
-    {json.dumps(content_json, indent=2)}
-    """
+    return make_training_entry(sfem_paths, content_json, label)
+
+def make_training_entry(sfem_paths, content_json, label):
+    # We combine both features into the prompt (budgeted, see prompt_builder)
+    user_prompt = PROMPT_BUILDER.build_context(content_json, sfem_paths)
     
     # Create the target output (The "Ground Truth" answer)
     expected_score = 10.0 if label == "Malicious" else 0.0
@@ -50,58 +51,194 @@ def generate_training_entry(filepath, label):
     }
 
     return {
-        "instruction": "Analyze this Office File for malware. Return JSON {score, reason}.",
+        "instruction": INSTRUCTION,
         "input": user_prompt,
         "output": json.dumps(expected_output)
     }
 
+def build_entry(filepath, label, known_sha256=None):
+    """Pool worker: hashes the file and, unless it is known_sha256 (already
+    built), extracts its training entry. Errors are returned, not raised."""
+    result = {"sha256": None, "entry": None, "error": None}
+    try:
+        result["sha256"] = calculate_sha256(filepath)
+        if result["sha256"] != known_sha256:
+            result["entry"] = generate_training_entry(filepath, label)
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def build_from_store(store_dir, output_file, labels_file=None):
+    """Writes the training set from a feature_store instead of the documents.
+
+    labels.csv still decides which files are in and with which label: each
+    filename once, in CSV order, with the label of its last row (like the
+    merged shards). Store rows are matched by the row's sha256, or else by
+    filename. Returns (entries written, labels.csv files not in the store)."""
+    from feature_store import FeatureStore  # needs pandas + pyarrow
+
+    labels = {}  # filename -> (sha256, label), in first-seen order
+    with open(labels_file or LABELS_FILE, 'r', newline='') as f_in:
+        for row in csv.DictReader(f_in):
+            if row.get('filename') and row.get('label'):
+                labels[row['filename']] = (row.get('sha256'), row['label'])
+
+    store = FeatureStore(store_dir)
+    rows = store.read(["sha256", "filename", "path_ids", "content"])
+    by_sha = {row.sha256: row for row in rows.itertuples()}
+    by_name = {row.filename: row for row in by_sha.values()}
+
+    written = missing = 0
+    with open(output_file, 'w') as f_out:
+        for filename, (sha256, label) in labels.items():
+            row = by_sha.get(sha256) or by_name.get(filename)
+            if row is None:
+                missing += 1
+                continue
+            # Like generate_training_entry, unreadable files get an entry with what was found
+            content_json = json.loads(row.content) if isinstance(row.content, str) else {}
+            entry = make_training_entry(store.decode_paths(row.path_ids), content_json, label)
+            f_out.write(json.dumps(entry) + "\n")
+            written += 1
+    return written, missing
+
+def iter_rows(dirs):
+    """(filename, label, filepath) for every usable labels.csv row"""
+    with open(LABELS_FILE, 'r') as f_in:
+        reader = csv.DictReader(f_in)
+
+        for row in reader:
+            filename=row['filename']
+            label = row['label'] 
+            # AUTOMATIC PATH FINDING
+            folder = dirs.get(label)
+
+            if not folder:
+                print(f"[ERROR] Unknown label '{label}' for {filename}")
+                continue
+
+            filepath = os.path.join(folder, filename)
+
+            # Debug print to help you verify paths
+            if not os.path.exists(filepath):
+                print(f"[MISSING] {filename} (Looked in: {filepath})")
+                continue
+
+            yield filename, label, filepath
+
 def main():
-    # --- FIX STARTS HERE ---
-    
     # 1. Use the dynamic DATA_DIR we calculated at the top
     DIRS = {
         "Malicious": os.path.join(DATA_DIR, "malware"),
         "Benign": os.path.join(DATA_DIR, "benign")
     }
-    
-    # 2. Use the global variables instead of re-defining hardcoded ones
-    # (LABELS_FILE and OUTPUT_FILE are already pointing to the right place)
-    
+
+    parser = argparse.ArgumentParser("build_dataset")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Extraction processes (default: all cores)")
+    parser.add_argument("--shard-dir", default=SHARD_DIR, help="Shards and manifest (the checkpoint)")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="Entries per shard")
+    parser.add_argument("--rebuild", action="store_true", help="Throw away the checkpoint and start over")
+    parser.add_argument("--from-store", metavar="DIR",
+                        help="Build from a feature_store.py store instead of parsing the documents")
+    parser.add_argument("--no-merge", action="store_true",
+                        help=f"Only write shards, not the combined {os.path.basename(OUTPUT_FILE)}")
+    args = parser.parse_args()
+
     print(f"--- Building Training Data ---")
     print(f"[*] Reading labels from: {LABELS_FILE}")
-    print(f"[*] Outputting to: {OUTPUT_FILE}")
+    print(f"[*] Shards and manifest in: {args.shard_dir}")
 
     if not os.path.exists(LABELS_FILE):
         print(f"[!] Error: Labels file not found at {LABELS_FILE}")
         return
 
-    with open(OUTPUT_FILE, 'w') as f_out:
-        with open(LABELS_FILE, 'r') as f_in:
-            reader = csv.DictReader(f_in)
-            
-            for row in reader:
-                filename=row['filename']
-                label = row['label'] 
-                # AUTOMATIC PATH FINDING
-                folder = DIRS.get(label)
-                
-                if not folder:
-                    print(f"[ERROR] Unknown label '{label}' for {filename}")
-                    continue
-                    
-                filepath = os.path.join(folder, filename)
-                
-                # Debug print to help you verify paths
-                if not os.path.exists(filepath):
-                    print(f"[MISSING] {filename} (Looked in: {filepath})")
-                    continue
-
-                try:
-                    entry = generate_training_entry(filepath, label)
-                    f_out.write(json.dumps(entry) + "\n")
-                    print(f"[PROCESSED] {filename} -> {label}")
-                except Exception as e:
-                    print(f"[ERROR] Could not extract features from {filename}: {e}")
+    if args.from_store:
+        written, missing = build_from_store(args.from_store, OUTPUT_FILE)
+        if missing:
+            print(f"[!] {missing} labelled files are not in the store (run feature_store.py to add them)")
+        print(f"[+] {written} entries written to {OUTPUT_FILE}")
+        return
+
+    if args.rebuild and os.path.isdir(args.shard_dir):
+        shutil.rmtree(args.shard_dir)
+
+    # 2. Files already built from the same bytes, label and features are skipped;
+    # everything else is fanned out over the pool, a bounded number at a time
+    dataset = ShardedDataset(args.shard_dir, args.shard_size)
+    workers = args.workers or os.cpu_count() or 1
+    max_in_flight = workers * 4
+    current = set()  # filenames whose manifest record matches this run's file, label and version
+    counts = {"built": 0, "skipped": 0, "errors": 0}
+    in_flight = {}
+    rows = iter_rows(DIRS)
+
+    def finish(future):
+        filename, label, st = in_flight.pop(future)
+        result = future.result()
+        if result["error"]:
+            counts["errors"] += 1
+            print(f"[ERROR] Could not extract features from {filename}: {result['error']}")
+            return  # not current: its old entry (maybe under an old label) stays out of the merge
+
+        existing = dataset.lookup(result["sha256"], label, FEATURE_VERSION)
+        if result["entry"] is None or existing is not None:
+            # Unchanged content (touched or renamed file): point at the existing line
+            counts["skipped"] += 1
+            if existing is not None:
+                dataset.record(filename, result["sha256"], label, FEATURE_VERSION,
+                               st.st_size, st.st_mtime, existing["shard"],
+                               existing["start"], existing["end"])
+            # entry None: same bytes as its own record, which has this label and version
+            current.add(filename)
+            return
+
+        dataset.add(result["entry"], filename, result["sha256"], label, FEATURE_VERSION,
+                    st.st_size, st.st_mtime)
+        current.add(filename)
+        counts["built"] += 1
+        print(f"[PROCESSED] {filename} -> {label}")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            exhausted = False
+            while in_flight or not exhausted:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    row = next(rows, None)
+                    if row is None:
+                        exhausted = True
+                        break
+                    filename, label, filepath = row
+
+                    st = os.stat(filepath)
+                    if dataset.is_current(filename, st.st_size, st.st_mtime, label, FEATURE_VERSION):
+                        counts["skipped"] += 1
+                        current.add(filename)
+                        continue
+
+                    known = dataset.by_name.get(filename)
+                    if known and known["label"] == label and known["version"] == FEATURE_VERSION:
+                        known_sha256 = known["sha256"]
+                    else:
+                        known_sha256 = None
+                    future = pool.submit(build_entry, filepath, label, known_sha256)
+                    in_flight[future] = (filename, label, st)
+
+                if in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+
+        print(f"\n[*] Built {counts['built']}, skipped {counts['skipped']} unchanged, "
+              f"{counts['errors']} errors")
+
+        # 3. One combined file for training: labels.csv rows whose entry is
+        # current for their label and version (failed rebuilds are left out)
+        if not args.no_merge:
+            written = dataset.merge(OUTPUT_FILE, current)
+            print(f"[+] {written} entries written to {OUTPUT_FILE}")
+    finally:
+        dataset.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,141 @@
+"""Sharded, resumable output for build_dataset.
+
+Entries go to numbered JSONL shards (shard-00000.jsonl, ...) of at most
+shard_size lines. Every entry written is recorded in manifest.jsonl with the
+file's SHA-256, label, size/mtime, the feature version and the byte range of
+its line in the shard. The manifest is the checkpoint:
+
+  * a line is appended to a shard first and to the manifest second, so on
+    restart anything past the last recorded byte of the open shard is a
+    half-written entry and is truncated away,
+  * files whose size/mtime (or else SHA-256), label and feature version match
+    a manifest record are not rebuilt,
+  * merge() writes one deduplicated JSONL with the current entry per file.
+"""
+import json
+import os
+
+DEFAULT_SHARD_SIZE = 10000
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def shard_name(index):
+    return f"shard-{index:05d}.jsonl"
+
+
+class ShardedDataset:
+    """Append-only shard writer plus the manifest that makes it resumable"""
+
+    def __init__(self, out_dir, shard_size=DEFAULT_SHARD_SIZE):
+        self.out_dir = out_dir
+        self.shard_size = max(1, shard_size)
+        self.manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+        os.makedirs(out_dir, exist_ok=True)
+
+        self.by_sha = {}   # sha256 -> latest record
+        self.by_name = {}  # filename -> latest record
+        self._load_manifest()
+        self._open_shard()
+        self._manifest = open(self.manifest_path, "a")
+
+    def _load_manifest(self):
+        self.records = []
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                self.records.append(record)
+                self.by_sha[record["sha256"]] = record
+                self.by_name[record["filename"]] = record
+
+    def _open_shard(self):
+        """Reopens the last recorded shard, cutting off anything not in the manifest"""
+        self.shard = max((r["shard"] for r in self.records), default=0)
+        recorded = [r for r in self.records if r["shard"] == self.shard]
+        end = max((r["end"] for r in recorded), default=0)
+        self.lines = len({r["start"] for r in recorded})
+
+        # Shards after the last recorded one only hold unrecorded lines
+        for name in os.listdir(self.out_dir):
+            if name.startswith("shard-") and name.endswith(".jsonl") and int(name[6:11]) > self.shard:
+                os.remove(os.path.join(self.out_dir, name))
+
+        path = os.path.join(self.out_dir, shard_name(self.shard))
+        self._shard = open(path, "ab")
+        self._shard.truncate(end)
+        self._shard.seek(end)
+
+    def is_current(self, filename, size, mtime, label, version):
+        """True when filename was built from this exact file, label and version"""
+        record = self.by_name.get(filename)
+        return (record is not None and record["size"] == size and record["mtime"] == mtime
+                and record["label"] == label and record["version"] == version)
+
+    def lookup(self, sha256, label, version):
+        """An existing record for the same content, label and version, if any"""
+        record = self.by_sha.get(sha256)
+        if record and record["label"] == label and record["version"] == version:
+            return record
+        return None
+
+    def add(self, entry, filename, sha256, label, version, size, mtime):
+        """Appends entry to the current shard and records it in the manifest"""
+        if self.lines >= self.shard_size:
+            self._shard.close()
+            self.shard += 1
+            self.lines = 0
+            self._shard = open(os.path.join(self.out_dir, shard_name(self.shard)), "wb")
+
+        data = (json.dumps(entry) + "\n").encode("utf-8")
+        start = self._shard.tell()
+        self._shard.write(data)
+        self._shard.flush()
+        self.lines += 1
+        return self.record(filename, sha256, label, version, size, mtime,
+                           self.shard, start, start + len(data))
+
+    def record(self, filename, sha256, label, version, size, mtime, shard, start, end):
+        """Writes a manifest record; also used to point a renamed duplicate at an existing line"""
+        record = {"sha256": sha256, "filename": filename, "label": label, "version": version,
+                  "size": size, "mtime": mtime, "shard": shard, "start": start, "end": end}
+        self._manifest.write(json.dumps(record) + "\n")
+        self._manifest.flush()
+        self.records.append(record)
+        self.by_sha[sha256] = record
+        self.by_name[filename] = record
+        return record
+
+    def merge(self, output_file, filenames=None):
+        """Writes the latest entry of every file (optionally only those in
+        filenames) to one JSONL, each distinct line once. Returns the count.
+        The latest entry may be from an older run: pass only filenames known
+        to be current (built or checked in this run) to leave stale ones out."""
+        self._shard.flush()
+        ranges = set()
+        for filename, record in self.by_name.items():
+            if filenames is None or filename in filenames:
+                ranges.add((record["shard"], record["start"], record["end"]))
+
+        count = 0
+        handles = {}
+        try:
+            with open(output_file, "wb") as out:
+                for shard, start, end in sorted(ranges):
+                    f = handles.get(shard)
+                    if f is None:
+                        f = handles[shard] = open(os.path.join(self.out_dir, shard_name(shard)), "rb")
+                    f.seek(start)
+                    out.write(f.read(end - start))
+                    count += 1
+        finally:
+            for f in handles.values():
+                f.close()
+        return count
+
+    def close(self):
+        self._shard.close()
+        self._manifest.close()
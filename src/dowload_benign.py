@@ -1,8 +1,8 @@
-import requests
 import os
-import csv
-import hashlib
-import time
+import argparse
+
+from download_engine import DownloadEngine, DownloadJob, DEFAULT_TIMEOUT, DEFAULT_WORKERS
+from labels_store import LabelsStore
 
 # CONFIGURATION
 # GovDocs1 Subset 000 (The "Gold Standard" for benign research files)
@@ -32,48 +32,25 @@ SOURCES = [
     }
 ]
 
-def calculate_sha256(file_path):
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
-
-def log_to_csv(filename, sha256):
-    # Ensure CSV exists
-    if not os.path.exists(LABELS_FILE):
-        with open(LABELS_FILE, 'w', newline='') as f:
-            csv.writer(f).writerow(["sha256", "filename", "label", "source"])
-
-    # Check for duplicates (simple check)
-    with open(LABELS_FILE, 'r') as f:
-        if sha256 in f.read():
-            return
-
-    with open(LABELS_FILE, 'a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([sha256, filename, "Benign", "ApachePOI"])
-
-def download_benign():
-    if not os.path.exists(BENIGN_DIR):
-        os.makedirs(BENIGN_DIR)
+def log_to_csv(labels, filename, sha256):
+    # The store skips known hashes and appends new rows to labels.csv when closed
+    labels.add(sha256, filename, "Benign", "ApachePOI")
 
-    print(f"[+] Starting Download from Apache POI Test Data...")
-    
-    total_downloaded = 0
-    
+def list_jobs(session):
+    """DownloadJobs for the POI test files we don't have yet"""
+    jobs = []
     for source in SOURCES:
         print(f"    Scanning {source['type']} repository...")
         try:
             # 1. Get File List from GitHub API
-            resp = requests.get(source['url'])
+            resp = session.get(source['url'], timeout=DEFAULT_TIMEOUT)
             if resp.status_code != 200:
                 print(f"    [-] Failed to list files: {resp.status_code}")
                 continue
                 
             files = resp.json()
             
-            # 2. Iterate and Download
+            # 2. Pick the files to download
             for f_item in files:
                 name = f_item['name']
                 download_url = f_item.get('download_url')
@@ -91,28 +68,42 @@ def download_benign():
                 if os.path.exists(target_path):
                     continue
                 
-                print(f"      Downloading {name}...")
-                
-                # Download File
-                file_resp = requests.get(download_url)
-                with open(target_path, "wb") as f_out:
-                    f_out.write(file_resp.content)
-                
-                # Log it
-                file_hash = calculate_sha256(target_path)
-                log_to_csv(name, file_hash)
-                
-                total_downloaded += 1
-                
-                # Limit to 20 files per type to avoid huge downloads (remove break for full set)
-                if total_downloaded % 20 == 0:
-                     print("      (Paused for 1s to be nice to GitHub API...)")
-                     time.sleep(1)
+                jobs.append(DownloadJob(download_url, target_path, meta=name))
 
         except Exception as e:
             print(f"    [-] Error processing {source['type']}: {e}")
+    return jobs
+
+def download_benign(workers=DEFAULT_WORKERS):
+    if not os.path.exists(BENIGN_DIR):
+        os.makedirs(BENIGN_DIR)
+
+    print(f"[+] Starting Download from Apache POI Test Data...")
+    
+    total_downloaded = 0
+    labels = LabelsStore(csv_path=LABELS_FILE)
+    
+    # One pooled session for the listings and the files; downloads run
+    # `workers` at a time and are hashed while they are written
+    with DownloadEngine(workers=workers) as engine:
+        jobs = list_jobs(engine.session)
+        print(f"    {len(jobs)} files to download ({engine.workers} at a time)...")
+
+        for result in engine.run(jobs):
+            name = result.job.meta
+            if result.error:
+                print(f"      [-] {name}: {result.error}")
+                continue
+
+            print(f"      Downloaded {name}" + (" (resumed)" if result.resumed else ""))
+            log_to_csv(labels, name, result.sha256)
+            total_downloaded += 1
 
+    labels.close()
     print(f"\n[+] Finished. Total benign files added: {total_downloaded}")
 
 if __name__ == "__main__":
-    download_benign()
\ No newline at end of file
+    parser = argparse.ArgumentParser("dowload_benign")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent downloads")
+    args = parser.parse_args()
+    download_benign(args.workers)
@@ -0,0 +1,218 @@
+"""Concurrent, resumable downloads for the corpus scripts.
+
+downloader.py and dowload_benign.py used to fetch one file at a time with a
+fresh connection each, hold every response in memory and hash the file again
+after writing it. DownloadEngine instead:
+
+  * shares one requests.Session (keep-alive, a connection pool per host),
+  * runs up to `workers` downloads at once,
+  * streams each response to <dest>.part, hashing as it writes,
+  * retries connection errors, timeouts, 429 and 5xx with exponential
+    backoff (honouring Retry-After),
+  * resumes a .part left by a failed attempt or an earlier run with a Range
+    request, when the server answers 206.
+
+    with DownloadEngine(workers=8) as engine:
+        jobs = [DownloadJob(url, os.path.join(folder, name), meta=name) for url, name in files]
+        for result in engine.run(jobs):
+            if result.error is None:
+                print(result.job.meta, result.sha256)
+
+download_stub.start_stub_server() serves files locally (with optional
+failures and truncated responses) to try it without network access.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1.0  # seconds, doubled per attempt
+MAX_BACKOFF = 30.0
+DEFAULT_TIMEOUT = (10, 60)  # (connect, read) seconds
+CHUNK_SIZE = 1024 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DownloadJob:
+    """One file to fetch.
+
+    dest:             final path; bytes go to dest + ".part" until complete
+    method/data:      e.g. "POST" with form data for the MalwareBazaar API
+    expected_sha256:  when set, a download with another hash is an error
+    meta:             anything the caller wants back with the result
+    """
+
+    __slots__ = ("url", "dest", "method", "data", "headers", "expected_sha256", "meta")
+
+    def __init__(self, url, dest, method="GET", data=None, headers=None, expected_sha256=None, meta=None):
+        self.url = url
+        self.dest = dest
+        self.method = method
+        self.data = data
+        self.headers = headers
+        self.expected_sha256 = expected_sha256
+        self.meta = meta
+
+
+class DownloadResult:
+    __slots__ = ("job", "path", "sha256", "size", "resumed", "attempts", "error")
+
+    def __init__(self, job, path=None, sha256=None, size=0, resumed=False, attempts=0, error=None):
+        self.job = job
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.resumed = resumed
+        self.attempts = attempts
+        self.error = error
+
+    def __repr__(self):
+        state = self.error or f"{self.size} bytes, sha256 {self.sha256[:12]}..."
+        return f"DownloadResult({self.job.url!r}, {state})"
+
+
+class _Retry(Exception):
+    def __init__(self, reason, wait=None):
+        super().__init__(reason)
+        self.wait = wait
+
+
+class DownloadEngine:
+    """Thread-safe; one instance per run, closed when done"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT, chunk_size=CHUNK_SIZE, headers=None):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._stop = threading.Event()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def fetch(self, job):
+        """Downloads one job; never raises, failures are in result.error"""
+        result = DownloadResult(job)
+        os.makedirs(os.path.dirname(os.path.abspath(job.dest)), exist_ok=True)
+
+        while True:
+            result.attempts += 1
+            try:
+                self._attempt(job, result)
+                break
+            except _Retry as e:
+                error, wait_for = str(e), e.wait
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                error, wait_for = f"{type(e).__name__}: {e}", None
+            except (requests.RequestException, OSError) as e:
+                result.error = f"{type(e).__name__}: {e}"
+                return result
+
+            if result.attempts > self.retries or self._stop.is_set():
+                result.error = error
+                return result
+            if wait_for is None:
+                wait_for = min(self.backoff * 2 ** (result.attempts - 1), MAX_BACKOFF)
+            self._stop.wait(wait_for)
+
+        if job.expected_sha256 and result.sha256 != job.expected_sha256.lower():
+            os.remove(job.dest)
+            result.error = f"sha256 mismatch (got {result.sha256})"
+        return result
+
+    def _attempt(self, job, result):
+        part = job.dest + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+
+        headers = dict(job.headers or {})
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        with self.session.request(job.method, job.url, data=job.data, headers=headers,
+                                  stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 416 and offset:
+                os.remove(part)  # our .part doesn't match what the server has; start over
+                raise _Retry("range not satisfiable", wait=0)
+            if resp.status_code in RETRY_STATUSES:
+                retry_after = resp.headers.get("Retry-After", "")
+                raise _Retry(f"HTTP {resp.status_code}",
+                             wait=min(float(retry_after), MAX_BACKOFF) if retry_after.isdigit() else None)
+            resp.raise_for_status()
+
+            hasher = hashlib.sha256()
+            if offset and resp.status_code == 206:
+                # Resuming: the bytes already on disk go into the hash first
+                with open(part, "rb") as f:
+                    for block in iter(lambda: f.read(self.chunk_size), b""):
+                        hasher.update(block)
+                mode = "ab"
+                result.resumed = True
+            else:
+                offset = 0
+                mode = "wb"
+
+            expected = resp.headers.get("Content-Length")
+            written = 0
+            with open(part, mode) as f:
+                for chunk in resp.iter_content(self.chunk_size):
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    written += len(chunk)
+
+            # Without this check a dropped connection would pass for a complete file
+            if expected is not None and resp.headers.get("Content-Encoding") is None and written < int(expected):
+                raise _Retry(f"connection closed after {written} of {expected} bytes")
+
+        os.replace(part, job.dest)
+        result.path = job.dest
+        result.sha256 = hasher.hexdigest()
+        result.size = offset + written
+
+    def run(self, jobs):
+        """Yields a DownloadResult per job, in completion order. jobs is read
+        lazily, at most 2 x workers ahead; stopping the iteration early
+        cancels whatever hasn't started (partial files stay for a resume)."""
+        jobs = iter(jobs)
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                exhausted = False
+                while in_flight or not exhausted:
+                    while not exhausted and len(in_flight) < 2 * self.workers:
+                        job = next(jobs, None)
+                        if job is None:
+                            exhausted = True
+                            break
+                        in_flight.add(pool.submit(self.fetch, job))
+                    if not in_flight:
+                        break
+
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def close(self):
+        self._stop.set()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,135 @@
+"""Local file server for trying out download_engine without network access.
+
+    server = start_stub_server({"a.docx": data_a, "b.xlsx": data_b}, fail_first=1, cut_first=True)
+    with DownloadEngine(backoff=0.01) as engine:
+        list(engine.run([DownloadJob(server.url + "/a.docx", "/tmp/a.docx")]))
+    server.shutdown()
+
+Files are served for GET and POST, with Range support (206). To exercise
+the retry and resume paths, the first `fail_first` requests for each file
+get a 503, and with cut_first=True the first full response of each file
+stops halfway through.
+"""
+import argparse
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._serve()
+
+    def do_POST(self):
+        self._serve()
+
+    def _serve(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)  # form data is ignored, but must not be left on a keep-alive connection
+        server = self.server
+        name = unquote(urlparse(self.path).path.lstrip("/"))
+        data = server.files.get(name)
+        if data is None:
+            self._reply(404, b"not found")
+            return
+
+        time.sleep(server.delay)
+        with server.lock:
+            server.requests += 1
+            seen = server.seen.get(name, 0)
+            server.seen[name] = seen + 1
+        if seen < server.fail_first:
+            self._reply(503, b"try again", {"Retry-After": "0"})
+            return
+
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= len(data):
+                self._reply(416, b"", {"Content-Range": f"bytes */{len(data)}"})
+                return
+
+        body = data[start:]
+        headers = {"Accept-Ranges": "bytes"}
+        status = 200
+        if match:
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+
+        cut = False
+        if server.cut_first and not match:
+            with server.lock:
+                cut = name not in server.cut
+                server.cut.add(name)
+        self._reply(status, body, headers, cut=cut)
+
+    def _reply(self, status, body, headers=None, cut=False):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if cut:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            self.wfile.write(body[:len(body) // 2] if cut else body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        if cut:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(files, host="127.0.0.1", port=0, delay=0.0, fail_first=0, cut_first=False):
+    """Serves files ({name: bytes}) on a background thread; port=0 picks a free port.
+
+    The returned server has .url, .requests (count served so far) and .shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), _FileHandler)
+    server.daemon_threads = True
+    server.files = files
+    server.delay = delay
+    server.fail_first = fail_first
+    server.cut_first = cut_first
+    server.lock = threading.Lock()
+    server.seen = {}
+    server.cut = set()
+    server.requests = 0
+    server.url = f"http://{host}:{server.server_address[1]}"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("download_stub")
+    parser.add_argument("folder", help="Serve the files in this folder")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait per request")
+    parser.add_argument("--fail-first", type=int, default=0, help="503s before serving each file")
+    parser.add_argument("--cut-first", action="store_true", help="Truncate the first response for each file")
+    args = parser.parse_args()
+
+    files = {}
+    for entry in os.scandir(args.folder):
+        if entry.is_file():
+            with open(entry.path, "rb") as f:
+                files[entry.name] = f.read()
+
+    server = start_stub_server(files, port=args.port, delay=args.delay,
+                               fail_first=args.fail_first, cut_first=args.cut_first)
+    print(f"[*] Serving {len(files)} files on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,15 +1,17 @@
-import requests
 import pyzipper
 import os
-import io
-import csv
 import sys
+import shutil
+import argparse
 from dotenv import load_dotenv
 
+from download_engine import DownloadEngine, DownloadJob, DEFAULT_TIMEOUT, DEFAULT_WORKERS
+from labels_store import LabelsStore
+
 load_dotenv()
 
 # --- CONFIGURATION ---
-API_URL = "https://mb-api.abuse.ch/api/v1/"
+API_URL = os.environ.get("MB_API_URL", "https://mb-api.abuse.ch/api/v1/")
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
 DATA_DIR = os.path.join(PROJECT_ROOT, "data")
@@ -37,21 +39,25 @@ def init_setup():
     if not os.path.exists(MALWARE_DIR):
         os.makedirs(MALWARE_DIR)
     
-    if not os.path.exists(LABELS_FILE):
-        with open(LABELS_FILE, 'w', newline='') as f:
-            csv.writer(f).writerow(["sha256", "filename", "label", "source"])
+    return LabelsStore(csv_path=LABELS_FILE)
 
-def log_sample(sha256, filename, label, source):
-    # Check for duplicates
-    if os.path.exists(LABELS_FILE):
-        with open(LABELS_FILE, 'r') as f:
-            if sha256 in f.read(): return
+def log_sample(labels, sha256, filename, label, source):
+    # The store skips known hashes and appends new rows to labels.csv when closed
+    labels.add(sha256, filename, label, source)
 
-    with open(LABELS_FILE, 'a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([sha256, filename, label, source])
+def _extract_sample(archive_path, final_path):
+    """Unpacks the single file in a MalwareBazaar zip (password 'infected') to final_path"""
+    with pyzipper.AESZipFile(archive_path) as zf:
+        zf.setpassword(PASSWORD)
+        
+        # MalwareBazaar usually puts one file inside the zip
+        internal_name = zf.namelist()[0]
+        
+        # Stream it straight to the human-readable name from the API
+        with zf.open(internal_name) as src, open(final_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
 
-def fetch_samples(file_type, target_count=10):
+def fetch_samples(labels, engine, file_type, target_count=10):
     print(f"[+] Searching for VALID {file_type} (Target: {target_count})...")
     
     # We fetch a larger batch because we might discard invalid ones
@@ -62,7 +68,7 @@ def fetch_samples(file_type, target_count=10):
     }
     
     try:
-        response = requests.post(API_URL, data=payload, headers=HEADERS)
+        response = engine.session.post(API_URL, data=payload, timeout=DEFAULT_TIMEOUT)
         data = response.json()
         
         if data["query_status"] != "ok":
@@ -70,10 +76,8 @@ def fetch_samples(file_type, target_count=10):
             return
 
         collected = 0
+        jobs = []
         for sample in data["data"]:
-            if collected >= target_count:
-                break
-
             sha256 = sample["sha256_hash"]
             real_filename = sample['file_name'] # This is the name we want!
             
@@ -84,31 +88,31 @@ def fetch_samples(file_type, target_count=10):
                 collected += 1
                 continue
 
-            # Download
-            dl_payload = {"query": "get_file", "sha256_hash": sha256}
-            dl_resp = requests.post(API_URL, data=dl_payload, headers=HEADERS)
-            
+            # The encrypted zip goes to a hidden file next to the samples (resumable as .part)
+            archive_path = os.path.join(MALWARE_DIR, f".{sha256}.zip")
+            jobs.append(DownloadJob(API_URL, archive_path, method="POST",
+                                    data={"query": "get_file", "sha256_hash": sha256},
+                                    meta=(sha256, real_filename, final_path)))
+
+        # Download concurrently; jobs are handed out lazily, so stopping at
+        # the target leaves the rest unfetched
+        results = engine.run(jobs)
+        for result in results:
+            if collected >= target_count:
+                results.close()
+                break
+
+            sha256, real_filename, final_path = result.job.meta
+            if result.error:
+                print(f"    [Error] Failed to download {real_filename}: {result.error}")
+                continue
+
             try:
-                # 1. Extract to a temp buffer
-                with pyzipper.AESZipFile(io.BytesIO(dl_resp.content)) as zf:
-                    zf.setpassword(PASSWORD)
-                    
-                    # MalwareBazaar usually puts one file inside the zip
-                    internal_name = zf.namelist()[0]
-                    
-                    # Extract it to disk
-                    zf.extract(internal_name, MALWARE_DIR)
-                    
-                    # 2. RENAME IT IMMEDIATELY
-                    # The file is currently on disk as `internal_name` (often the hash)
-                    temp_path = os.path.join(MALWARE_DIR, internal_name)
-                    
-                    # Rename to the human-readable name from the API
-                    os.rename(temp_path, final_path)
+                _extract_sample(result.path, final_path)
                 
-                # 3. Validation Check
+                # Validation Check
                 if is_zip_header(final_path):
-                    log_sample(sha256, real_filename, "Malicious", "MalwareBazaar")
+                    log_sample(labels, sha256, real_filename, "Malicious", "MalwareBazaar")
                     print(f"    [Saved] {real_filename}")
                     collected += 1
                 else:
@@ -118,12 +122,27 @@ def fetch_samples(file_type, target_count=10):
 
             except Exception as e:
                 print(f"    [Error] Failed to process {real_filename}: {e}")
+            finally:
+                os.remove(result.path)
+
+        # Archives fetched past the target were never unpacked
+        for job in jobs:
+            if os.path.exists(job.dest):
+                os.remove(job.dest)
 
     except Exception as e:
         print(f"[-] Network Error: {e}")
 
 if __name__ == "__main__":
-    init_setup()
-    fetch_samples("docx", target_count=100)
-    fetch_samples("xlsx", target_count=75)
-    fetch_samples("pptx", target_count=50)
\ No newline at end of file
+    parser = argparse.ArgumentParser("downloader")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent downloads")
+    args = parser.parse_args()
+
+    labels = init_setup()
+    try:
+        with DownloadEngine(workers=args.workers, headers=HEADERS) as engine:
+            fetch_samples(labels, engine, "docx", target_count=100)
+            fetch_samples(labels, engine, "xlsx", target_count=75)
+            fetch_samples(labels, engine, "pptx", target_count=50)
+    finally:
+        labels.close()
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""Columnar feature store for SFEM paths and extracted content.
+
+One extraction pass over the labelled samples writes one row per file to
+Parquet (via pandas + pyarrow):
+
+    sha256, filename, label, size, error,
+    path_ids        SFEM path set as ids into the path vocabulary
+    part_names, part_sizes, compressed_bytes, uncompressed_bytes
+    vba_macros, vba_code_chars, vba_flags   olevba summary
+    content         the Office2JSON content dict as compact JSON
+
+Rows are written in batches as separate files under <store>/files/, and the
+path vocabulary (path_id -> path) lives in <store>/paths.parquet, so paths
+are stored once no matter how many files share them. Readers ask only for
+the columns they need:
+
+    store = FeatureStore()
+    labels = store.read(["sha256", "label"])
+    for row in store.read(["path_ids", "content"]).itertuples():
+        paths = store.decode_paths(row.path_ids)
+
+Re-running the build only extracts files whose SHA-256 is not stored yet.
+"""
+import argparse
+import csv
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd  # Parquet needs pyarrow as well
+
+from ooxml_stream import DocumentScan, PathVocabulary, scan_document
+from verdict_cache import calculate_sha256
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(PROJECT_ROOT, "data")
+LABELS_FILE = os.path.join(DATA_DIR, "labels.csv")
+DEFAULT_STORE_DIR = os.path.join(DATA_DIR, "features")
+
+DEFAULT_BATCH_SIZE = 1000  # rows per Parquet file
+COMPRESSION = "zstd"
+
+
+def _vba_results(content):
+    """olevba result dicts anywhere in the content tree"""
+    for key, value in content.items():
+        if key == "vbaProject.bin" and isinstance(value, dict):
+            yield value
+        elif isinstance(value, dict):
+            yield from _vba_results(value)
+
+
+def extract_features(filepath, label=None, sha256=None):
+    """Pool worker: one streaming pass over the file -> one store row (paths
+    still as strings; FeatureStore.add encodes them)"""
+    row = {
+        "sha256": sha256 or calculate_sha256(filepath),
+        "filename": os.path.basename(filepath),
+        "label": label,
+        "size": os.path.getsize(filepath),
+        "error": None,
+    }
+
+    scan = DocumentScan()
+    if not zipfile.is_zipfile(filepath):
+        row["error"] = "not a zip archive"
+    else:
+        try:
+            scan_document(filepath, with_content=True, scan=scan)
+        except Exception as e:
+            row["error"] = str(e) or type(e).__name__
+
+    vba = list(_vba_results(scan.content))
+    macros = [m for v in vba for m in v.get("macros") or []]
+    row.update({
+        "paths": sorted(scan.paths),
+        "part_names": list(scan.part_sizes),
+        "part_sizes": list(scan.part_sizes.values()),
+        "compressed_bytes": (scan.directory or {}).get("compressed_bytes", 0),
+        "uncompressed_bytes": (scan.directory or {}).get("uncompressed_bytes", 0),
+        "vba_macros": len(macros),
+        "vba_code_chars": sum(len(m.get("code") or "") for m in macros),
+        "vba_flags": sorted({f"{a.get('type')}:{a.get('keyword')}"
+                             for v in vba for a in v.get("analysis") or []}),
+        "content": json.dumps(scan.content, separators=(",", ":")) if row["error"] is None else None,
+    })
+    return row
+
+
+class FeatureStore:
+    """Parquet-backed rows plus the shared path vocabulary"""
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, batch_size=DEFAULT_BATCH_SIZE):
+        self.store_dir = store_dir
+        self.files_dir = os.path.join(store_dir, "files")
+        self.vocab_file = os.path.join(store_dir, "paths.parquet")
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+        self._vocab = None
+
+    # --- path vocabulary ---
+
+    @property
+    def vocabulary(self):
+        """The store's PathVocabulary (ids differ from the in-process one)"""
+        if self._vocab is None:
+            paths = []
+            if os.path.exists(self.vocab_file):
+                paths = pd.read_parquet(self.vocab_file, columns=["path"])["path"].tolist()
+            self._vocab = PathVocabulary(paths)
+        return self._vocab
+
+    def encode_paths(self, paths):
+        intern = self.vocabulary.intern
+        return [intern(path) for path in paths]
+
+    def decode_paths(self, path_ids):
+        paths = self.vocabulary.paths
+        return [paths[i] for i in path_ids]
+
+    def path_counts(self):
+        """Number of stored files containing each path id (NumPy array)"""
+        from path_sets import path_counts
+        return path_counts(list(self.read(["path_ids"])["path_ids"]), len(self.vocabulary))
+
+    # --- rows ---
+
+    def _part_files(self):
+        if not os.path.isdir(self.files_dir):
+            return []
+        return sorted(os.path.join(self.files_dir, name)
+                      for name in os.listdir(self.files_dir) if name.endswith(".parquet"))
+
+    def read(self, columns=None):
+        """DataFrame of the stored rows; only the given columns are read from disk"""
+        parts = self._part_files()
+        if not parts:
+            return pd.DataFrame(columns=columns)
+        return pd.concat([pd.read_parquet(p, columns=columns) for p in parts], ignore_index=True)
+
+    def known_sha256(self):
+        return set(self.read(["sha256"])["sha256"])
+
+    def add(self, row):
+        """Buffers a row from extract_features; written every batch_size rows"""
+        row = dict(row)
+        row["path_ids"] = self.encode_paths(row.pop("paths"))
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        os.makedirs(self.files_dir, exist_ok=True)
+
+        # Vocabulary first: every id in a written row file must resolve
+        tmp = self.vocab_file + ".tmp"
+        paths = self.vocabulary.paths
+        pd.DataFrame({"path_id": range(len(paths)), "path": paths}).to_parquet(
+            tmp, index=False, compression=COMPRESSION)
+        os.replace(tmp, self.vocab_file)
+
+        index = len(self._part_files())
+        path = os.path.join(self.files_dir, f"part-{index:05d}.parquet")
+        tmp = path + ".tmp"
+        pd.DataFrame(self._pending).to_parquet(tmp, index=False, compression=COMPRESSION)
+        os.replace(tmp, path)
+        self._pending = []
+
+
+def iter_labelled_files(labels_file=LABELS_FILE, data_dir=DATA_DIR):
+    """(filepath, label) for each labels.csv row whose file exists, each file once"""
+    dirs = {
+        "Malicious": os.path.join(data_dir, "malware"),
+        "Benign": os.path.join(data_dir, "benign"),
+    }
+    seen = set()
+    with open(labels_file, 'r') as f:
+        for row in csv.DictReader(f):
+            folder = dirs.get(row['label'])
+            if not folder:
+                continue
+            filepath = os.path.join(folder, row['filename'])
+            if filepath in seen or not os.path.exists(filepath):
+                continue
+            seen.add(filepath)
+            yield filepath, row['label']
+
+
+def build(store, files, workers=None):
+    """Extracts every (filepath, label) whose content is not stored yet.
+    Returns (added, skipped)."""
+    known = store.known_sha256()
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 4
+    added = skipped = 0
+    in_flight = set()
+    files = iter(files)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                item = next(files, None)
+                if item is None:
+                    exhausted = True
+                    break
+                filepath, label = item
+                # Hashing is far cheaper than extracting, so skip stored files up front
+                sha256 = calculate_sha256(filepath)
+                if sha256 in known:
+                    skipped += 1
+                    continue
+                known.add(sha256)
+                in_flight.add(pool.submit(extract_features, filepath, label, sha256))
+
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                row = future.result()
+                store.add(row)
+                added += 1
+                print(f"[+] {row['filename']} -> {row['label']}"
+                      + (f" (error: {row['error']})" if row["error"] else ""))
+
+    store.flush()
+    return added, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("feature_store")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR, help="Feature store directory")
+    parser.add_argument("--labels", default=LABELS_FILE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per Parquet file")
+    args = parser.parse_args()
+
+    print(f"--- Building Feature Store ---")
+    print(f"[*] Reading labels from: {args.labels}")
+    store = FeatureStore(args.store, args.batch_size)
+    added, skipped = build(store, iter_labelled_files(args.labels), args.workers)
+    print(f"\n[*] Added {added} files, {skipped} already stored, "
+          f"{len(store.vocabulary)} distinct paths")
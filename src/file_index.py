@@ -0,0 +1,246 @@
+"""Persisted index of already-processed files, for incremental rescans.
+
+Model.main, scan_malware and scan_benign used to list and reprocess the whole
+directory on every run. FileIndex remembers (path, size, mtime, SHA-256) per
+consumer ("scope") in SQLite, so a rescan:
+
+  * stats every entry (os.scandir, no reads) and skips the unchanged ones,
+  * hashes only files whose size or mtime moved, and skips those whose
+    content turns out to be the same (touched, copied back),
+  * forgets files that were deleted.
+
+watch() goes further and follows the directory with inotify (Linux), so new
+files are picked up as they are closed, at a cost proportional to what
+changed; elsewhere it falls back to a stat-diff every `interval` seconds.
+
+    index = FileIndex()
+    for change in index.changes(folder, "scan_malware"):
+        process(change.path)
+        index.mark("scan_malware", change)
+    index.close()
+
+A file that is never marked (failed, or the model was unreachable) comes
+back on the next rescan.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+
+from verdict_cache import calculate_sha256
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+DEFAULT_INDEX_FILE = os.path.join(PROJECT_ROOT, "data", "file_index.db")
+
+COMMIT_EVERY = 500  # marks per transaction
+POLL_INTERVAL = 2.0  # seconds between stat-diffs when inotify isn't available
+
+
+class FileChange:
+    """A new or modified file: what the index will record once it is processed"""
+
+    __slots__ = ("path", "size", "mtime_ns", "sha256", "previous_sha256")
+
+    def __init__(self, path, size, mtime_ns, sha256, previous_sha256=None):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+        self.previous_sha256 = previous_sha256
+
+    def __repr__(self):
+        return f"FileChange({self.path!r}, sha256={self.sha256[:12]}...)"
+
+
+class FileIndex:
+    """SQLite-backed; safe to share between threads of one process"""
+
+    def __init__(self, db_path=DEFAULT_INDEX_FILE):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                scope TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (scope, path)
+            )""")
+        self._db.commit()
+
+    def _known(self, scope, directory):
+        prefix = os.path.join(os.path.abspath(directory), "")
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, size, mtime_ns, sha256 FROM files WHERE scope = ? AND substr(path, 1, ?) = ?",
+                (scope, len(prefix), prefix)).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def check(self, scope, path, st=None, known=None):
+        """FileChange if path is new or its content changed since it was marked, else None.
+        A file that was only touched gets its new stat recorded without a rescan."""
+        path = os.path.abspath(path)
+        st = st or os.stat(path)
+        if known is None:
+            with self._lock:
+                row = self._db.execute("SELECT size, mtime_ns, sha256 FROM files WHERE scope = ? AND path = ?",
+                                       (scope, path)).fetchone()
+        else:
+            row = known.get(path)
+
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return None
+        sha256 = calculate_sha256(path)
+        change = FileChange(path, st.st_size, st.st_mtime_ns, sha256, row[2] if row else None)
+        if row is not None and row[2] == sha256:
+            self.mark(scope, change)
+            return None
+        return change
+
+    def changes(self, directory, scope):
+        """Yields a FileChange per new or modified regular file directly in
+        directory (no recursion, dot-files skipped); drops deleted files from the index"""
+        known = self._known(scope, directory)
+        seen = set()
+        for entry in os.scandir(directory):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            path = os.path.abspath(entry.path)
+            seen.add(path)
+            try:
+                change = self.check(scope, path, entry.stat(), known)
+            except OSError:
+                continue  # vanished between scandir and hashing
+            if change is not None:
+                yield change
+
+        gone = [path for path in known if path not in seen]
+        if gone:
+            with self._lock:
+                self._db.executemany("DELETE FROM files WHERE scope = ? AND path = ?",
+                                     [(scope, path) for path in gone])
+                self._db.commit()
+
+    def mark(self, scope, change):
+        """Records change as processed for scope"""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                             (scope, change.path, change.size, change.mtime_ns, change.sha256))
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self._db.commit()
+                self._pending = 0
+
+    def watch(self, directory, scope, interval=POLL_INTERVAL, stop=None):
+        """Yields lists of FileChanges: changes() first, then whatever appears
+        or changes in directory, until stop (a threading.Event) is set.
+        Empty batches are not yielded."""
+        # Watch before the first diff: a file closed in between is then an event, not lost
+        notifier = _Inotify.open(directory)
+        try:
+            batch = list(self.changes(directory, scope))
+            if batch:
+                yield batch
+
+            while stop is None or not stop.is_set():
+                if notifier is None:
+                    time.sleep(interval)
+                    batch = list(self.changes(directory, scope))
+                else:
+                    batch = []
+                    for name in notifier.read(timeout=interval):
+                        path = os.path.join(directory, name)
+                        if name.startswith('.'):
+                            continue
+                        try:
+                            if not os.path.isfile(path):
+                                continue
+                            change = self.check(scope, path)
+                        except OSError:
+                            continue
+                        if change is not None:
+                            batch.append(change)
+                if batch:
+                    yield batch
+        finally:
+            if notifier is not None:
+                notifier.close()
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+# Minimal inotify binding (no third-party dependency); Linux only
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = 0o4000
+_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    def __init__(self, fd):
+        self.fd = fd
+
+    @classmethod
+    def open(cls, directory):
+        """Watcher for files written or moved into directory, or None where inotify is unavailable"""
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            return None
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            fd = libc.inotify_init1(_IN_NONBLOCK)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory), _IN_CLOSE_WRITE | _IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return cls(fd)
+
+    def read(self, timeout):
+        """File names with events, waiting up to timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        names = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, _, _, length = _EVENT.unpack_from(data, offset)
+            raw = data[offset + _EVENT.size: offset + _EVENT.size + length]
+            offset += _EVENT.size + length
+            name = os.fsdecode(raw.rstrip(b"\0"))
+            if name and name not in names:
+                names.append(name)
+        return names
+
+    def close(self):
+        os.close(self.fd)
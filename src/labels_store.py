@@ -0,0 +1,256 @@
+"""Labels store: the rows of labels.csv in SQLite, indexed by SHA-256.
+
+The ingest scripts (downloader, dowload_benign, scan_malware, scan_benign)
+used to re-read the whole labels.csv per sample to look for duplicates, or
+not check at all. LabelsStore keeps the labels in SQLite indexed by
+SHA-256, so "have we got this one?" is an index lookup and inserts are
+batched into transactions:
+
+    with LabelsStore() as labels:
+        if labels.add(sha256, filename, "Malicious", "MalwareBazaar"):
+            print("new sample")
+
+labels.csv stays the file everything else reads (build_dataset,
+feature_store, prune_dataset) and the one under version control. The store
+holds every one of its rows, repeats included (labels.csv may already list
+one content under several filenames), and never rewrites it: the CSV is
+re-imported when it changed outside the store (edited by hand, pruned,
+pulled from git) and rows added here are appended to it on close. Ingest
+never adds a repeat: add() skips any SHA-256 the store already has,
+whatever its filename or label.
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(PROJECT_ROOT, "data")
+LABELS_FILE = os.path.join(DATA_DIR, "labels.csv")
+DEFAULT_LABELS_DB = os.path.join(DATA_DIR, "labels.db")
+
+FIELDS = ["sha256", "filename", "label", "source"]
+COMMIT_EVERY = 1000  # adds per transaction
+
+
+class LabelsStore:
+    """SQLite-backed; safe to share between threads of one process.
+
+    csv_path:  labels.csv to import from / append to (None = SQLite only)
+    """
+
+    def __init__(self, db_path=DEFAULT_LABELS_DB, csv_path=LABELS_FILE):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(labels)")]
+        if columns and "in_csv" not in columns:
+            # Stores from before rows were mirrored one to one: rebuild from the CSV
+            self._db.execute("DROP TABLE labels")
+            self._db.execute("DROP TABLE IF EXISTS meta")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS labels (
+                sha256 TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                label TEXT NOT NULL,
+                source TEXT,
+                added REAL NOT NULL,
+                in_csv INTEGER NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS labels_sample ON labels (sha256, filename)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+
+        if csv_path and os.path.exists(csv_path) and self._csv_stamp() != self._meta("csv_stamp"):
+            self.import_csv(csv_path, replace=True)
+
+    def _csv_stamp(self):
+        st = os.stat(self.csv_path)
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def _meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def _known(self, sha256):
+        return self._db.execute("SELECT 1 FROM labels WHERE sha256 = ?", (sha256,)).fetchone() is not None
+
+    def __contains__(self, sha256):
+        with self._lock:
+            return self._known(sha256)
+
+    def get(self, sha256):
+        """First row for the hash as {"sha256", "filename", "label", "source"}, or None"""
+        with self._lock:
+            row = self._db.execute("SELECT sha256, filename, label, source FROM labels WHERE sha256 = ? "
+                                   "ORDER BY rowid LIMIT 1", (sha256,)).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    def add(self, sha256, filename, label, source):
+        """Inserts the sample unless its hash is already labelled (under any
+        filename); True when it was new"""
+        with self._lock:
+            if self._known(sha256):
+                return False
+            self._db.execute("INSERT INTO labels VALUES (?, ?, ?, ?, ?, 0)",
+                             (sha256, filename, label, source, time.time()))
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self._db.commit()
+                self._pending = 0
+            return True
+
+    def add_many(self, rows):
+        """rows of (sha256, filename, label, source) in one transaction; returns how many were new"""
+        now = time.time()
+        added = 0
+        with self._lock:
+            for sha256, filename, label, source in rows:
+                if not self._known(sha256):
+                    self._db.execute("INSERT INTO labels VALUES (?, ?, ?, ?, ?, 0)",
+                                     (sha256, filename, label, source, now))
+                    added += 1
+            self._db.commit()
+            self._pending = 0
+        return added
+
+    def rows(self):
+        """All rows in order (labels.csv's, then the ones added since), as
+        dicts like csv.DictReader's"""
+        with self._lock:
+            rows = self._db.execute("SELECT sha256, filename, label, source FROM labels "
+                                    "ORDER BY in_csv DESC, rowid").fetchall()
+        return [dict(zip(FIELDS, row)) for row in rows]
+
+    def import_csv(self, csv_path, replace=False):
+        """Loads a labels CSV. replace=True (only for the store's own CSV)
+        makes the store hold exactly its rows, plus rows added here that
+        haven't been appended to it yet. Otherwise rows whose sha256 is
+        new are added, to be appended on close.
+        Returns rows now in the store."""
+        with open(csv_path, 'r', newline='') as f:
+            rows = [(row.get('sha256'), row.get('filename'), row.get('label'), row.get('source'))
+                    for row in csv.DictReader(f)]
+        rows = [row for row in rows if row[0] and row[1] and row[2]]
+
+        now = time.time()
+        own = bool(self.csv_path) and os.path.abspath(csv_path) == os.path.abspath(self.csv_path)
+        if replace and not own:
+            raise ValueError("replace=True is only for the store's own labels.csv")
+        with self._lock:
+            if replace:
+                self._db.execute("DELETE FROM labels WHERE in_csv = 1")
+                self._db.executemany("INSERT INTO labels VALUES (?, ?, ?, ?, ?, 1)",
+                                     ((*row, now) for row in rows))
+                # Rows not appended yet whose hash the new CSV already has
+                self._db.execute("""
+                    DELETE FROM labels WHERE in_csv = 0 AND EXISTS (
+                        SELECT 1 FROM labels AS c WHERE c.in_csv = 1 AND c.sha256 = labels.sha256)""")
+                self._set_meta("csv_stamp", self._csv_stamp())
+            else:
+                for sha256, filename, label, source in rows:
+                    if not self._known(sha256):
+                        self._db.execute("INSERT INTO labels VALUES (?, ?, ?, ?, ?, 0)",
+                                         (sha256, filename, label, source, now))
+            self._db.commit()
+            self._pending = 0
+            return self._db.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def append_csv(self):
+        """Appends the rows added since the last import/append to labels.csv,
+        leaving its existing bytes alone. Returns how many were written."""
+        with self._lock:
+            new = self._db.execute("SELECT rowid, sha256, filename, label, source FROM labels "
+                                   "WHERE in_csv = 0 ORDER BY rowid").fetchall()
+        if not new:
+            return 0
+
+        exists = os.path.exists(self.csv_path) and os.path.getsize(self.csv_path) > 0
+        if exists:
+            with open(self.csv_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                missing_newline = f.read(1) not in (b"\n", b"\r")
+        with open(self.csv_path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if not exists:
+                writer.writerow(FIELDS)
+            elif missing_newline:
+                f.write("\r\n")
+            writer.writerows(row[1:] for row in new)
+
+        with self._lock:
+            self._db.executemany("UPDATE labels SET in_csv = 1 WHERE rowid = ?", ((row[0],) for row in new))
+            self._set_meta("csv_stamp", self._csv_stamp())
+            self._db.commit()
+        return len(new)
+
+    def export_csv(self, csv_path):
+        """Writes every row to another CSV (atomically); labels.csv itself is
+        only ever appended to (append_csv)"""
+        if self.csv_path and os.path.abspath(csv_path) == os.path.abspath(self.csv_path):
+            raise ValueError("labels.csv is appended to, not rewritten; use append_csv()")
+        rows = self.rows()
+        tmp = csv_path + ".tmp"
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            writer.writerows([row[k] for k in FIELDS] for row in rows)
+        os.replace(tmp, csv_path)
+        return len(rows)
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def close(self):
+        """Commits, and appends the rows added here to labels.csv"""
+        self.flush()
+        if self.csv_path:
+            self.append_csv()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser("labels_store")
+    parser.add_argument("--db", default=DEFAULT_LABELS_DB)
+    parser.add_argument("--import", dest="import_csv", metavar="CSV",
+                        help="Merge a labels CSV into the store (rows with a new sha256 are appended to labels.csv)")
+    parser.add_argument("--export", metavar="CSV", help="Write every row to this CSV (not labels.csv itself)")
+    args = parser.parse_args()
+
+    with LabelsStore(args.db) as labels:
+        if args.import_csv:
+            before = len(labels)
+            total = labels.import_csv(args.import_csv)
+            print(f"[+] Imported {total - before} new samples from {args.import_csv}")
+        if args.export:
+            print(f"[+] Exported {labels.export_csv(args.export)} samples to {args.export}")
+        print(f"[*] {len(labels)} samples in {args.db}")
+
+
+if __name__ == "__main__":
+    main()
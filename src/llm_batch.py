@@ -0,0 +1,87 @@
+"""Groups waiting documents into batched model requests.
+
+LocalMalwareScanner.analyze_batch sends several documents in one chat
+request. Two knobs decide how batches form:
+
+    batch_size:  most documents per batch (1 = no batching)
+    max_wait:    seconds the first document of a batch waits for company
+
+A bigger batch means fewer requests and less repeated prompt prefix for the
+model to evaluate (throughput). A shorter wait means a lone document isn't
+held back (latency). A full batch goes out at once; otherwise it goes out
+when max_wait runs out.
+
+BatchScanner's inference threads call collect() on their queue.
+VerdictBatcher is for callers that each hold one document, like the
+daemon's request threads: submit() returns a Future, and one background
+thread forms the batches.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_MAX_WAIT = 0.2  # seconds
+
+_STOP = object()
+
+
+def collect(q, first, batch_size, max_wait, sentinel):
+    """[first] plus whatever arrives on q within max_wait, up to batch_size.
+    Returns (batch, stopped); stopped is True when sentinel was read."""
+    batch = [first]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        try:
+            item = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+        except queue.Empty:
+            break
+        if item is sentinel:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+class VerdictBatcher:
+    """Batches concurrent analyze() calls from many threads into analyze_batch().
+    `workers` batches can be at the model at once."""
+
+    def __init__(self, analyst, batch_size=DEFAULT_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT, workers=1):
+        self.analyst = analyst
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, content_json, sfem_paths, report=None):
+        """Future resolving to the verdict JSON string"""
+        future = Future()
+        self._queue.put((content_json, sfem_paths, report if report is not None else {}, future))
+        return future
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stopped = collect(self._queue, first, self.batch_size, self.max_wait, _STOP)
+            try:
+                verdicts = self.analyst.analyze_batch([(c, p) for c, p, _, _ in batch],
+                                                      reports=[r for _, _, r, _ in batch])
+                for (_, _, _, future), verdict in zip(batch, verdicts):
+                    future.set_result(verdict)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+            if stopped:
+                return
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join()
@@ -0,0 +1,204 @@
+"""Per-stage timing and counters for the scan pipeline.
+
+Instrumented code asks for the current registry and records into it:
+
+    metrics = get_metrics()
+    with metrics.timer("sieve"):
+        ...
+    metrics.inc("bytes_read_total", n)
+
+By default the registry is a NullMetrics whose methods do nothing, so the
+hooks cost one attribute lookup and a call when metrics are off. enable()
+swaps in a real Metrics registry, which can be dumped in Prometheus text
+format or as JSON lines. Pool workers record into their own registry and
+ship a snapshot() back to the parent, which merge()s it.
+"""
+import json
+import threading
+import time
+
+PREFIX = "tsa_"
+
+# Seconds for stage timers, and a coarser set for sizes (bytes / chars)
+TIME_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class _Timer:
+    def __init__(self, metrics, stage, labels):
+        self.metrics = metrics
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe("stage_seconds", time.perf_counter() - self.start,
+                             buckets=TIME_BUCKETS, stage=self.stage, **self.labels)
+        return False
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms"""
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}  # key -> [buckets, bucket_counts, count, sum]
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SIZE_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [tuple(buckets), [0] * len(buckets), 0, 0.0]
+            for i, bound in enumerate(hist[0]):
+                if value <= bound:
+                    hist[1][i] += 1
+            hist[2] += 1
+            hist[3] += value
+
+    def timer(self, stage, **labels):
+        """Context manager recording stage_seconds{stage=...}"""
+        return _Timer(self, stage, labels)
+
+    def snapshot(self):
+        """Picklable copy of everything recorded so far"""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {k: [v[0], list(v[1]), v[2], v[3]] for k, v in self.histograms.items()},
+            }
+
+    def merge(self, snapshot):
+        """Adds a snapshot() taken in another process or registry"""
+        if not snapshot:
+            return
+        with self._lock:
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (buckets, counts, count, total) in snapshot["histograms"].items():
+                hist = self.histograms.get(key)
+                if hist is None:
+                    self.histograms[key] = [buckets, list(counts), count, total]
+                    continue
+                hist[1] = [a + b for a, b in zip(hist[1], counts)]
+                hist[2] += count
+                hist[3] += total
+
+    def export_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+        snap = self.snapshot()
+
+        seen = set()
+        for (name, labels), value in sorted(snap["counters"].items()):
+            metric = PREFIX + name
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{_labels(labels)} {value}")
+
+        for (name, labels), (buckets, counts, count, total) in sorted(snap["histograms"].items()):
+            metric = PREFIX + name
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} histogram")
+                seen.add(metric)
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{metric}_bucket{_labels(labels, le=repr(float(bound)))} {bucket_count}")
+            lines.append(f"{metric}_bucket{_labels(labels, le='+Inf')} {count}")
+            lines.append(f"{metric}_sum{_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def export_jsonl(self):
+        """One JSON object per series"""
+        lines = []
+        snap = self.snapshot()
+        for (name, labels), value in sorted(snap["counters"].items()):
+            lines.append(json.dumps({"name": PREFIX + name, "type": "counter",
+                                     "labels": dict(labels), "value": value}))
+        for (name, labels), (buckets, counts, count, total) in sorted(snap["histograms"].items()):
+            lines.append(json.dumps({"name": PREFIX + name, "type": "histogram",
+                                     "labels": dict(labels), "count": count, "sum": total,
+                                     "buckets": dict(zip(map(str, buckets), counts))}))
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def write(self, path, fmt="prometheus"):
+        text = self.export_jsonl() if fmt == "jsonl" else self.export_prometheus()
+        with open(path, "w") as f:
+            f.write(text)
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{str(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics:
+    """Same interface as Metrics, records nothing"""
+
+    enabled = False
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, buckets=SIZE_BUCKETS, **labels):
+        pass
+
+    def timer(self, stage, **labels):
+        return _NULL_TIMER
+
+    def snapshot(self):
+        return None
+
+    def merge(self, snapshot):
+        pass
+
+
+_current = NullMetrics()
+
+
+def get_metrics():
+    return _current
+
+
+def set_metrics(metrics):
+    """Installs a registry (Metrics or NullMetrics) and returns the previous one"""
+    global _current
+    previous, _current = _current, metrics
+    return previous
+
+
+def enable():
+    """Switches to a fresh recording registry and returns it"""
+    set_metrics(Metrics())
+    return _current
@@ -0,0 +1,100 @@
+"""Local stand-in for the Ollama /api/chat endpoint.
+
+Lets LocalMalwareScanner (sync and async) run without a model server, e.g.
+for benchmarks or for trying out concurrency/timeout/retry settings:
+
+    server = start_stub_server(delay=0.2)
+    scanner = LocalMalwareScanner(host=server.url)
+    ...
+    server.shutdown()
+
+Every request gets the same canned verdict back after `delay` seconds.
+Batched prompts (LocalMalwareScanner.analyze_batch) get that verdict for
+each document id, unless the server was started with batch=False, which
+mimics a model that ignores the batch format. `reply` replaces the verdict
+with raw text, e.g. near-JSON to exercise verdicts.parse_verdict's repair.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_VERDICT = {"score": 0.0, "reason": "Stub verdict (no model loaded)."}
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection reuse is visible
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path != "/api/chat":
+            self._reply(404, {"error": f"unknown endpoint {self.path}"})
+            return
+
+        time.sleep(self.server.delay)
+        self.server.requests += 1
+        content = self.server.reply if self.server.reply is not None else json.dumps(self.server.verdict)
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        doc_ids = re.findall(r"=== DOCUMENT (\S+) ===", prompt)
+        if doc_ids and self.server.batch:
+            content = json.dumps({"verdicts": [dict(self.server.verdict, id=i) for i in doc_ids]})
+        self._reply(200, {
+            "model": body.get("model", ""),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client gave up (timeout test)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host="127.0.0.1", port=0, delay=0.0, verdict=None, batch=True, reply=None):
+    """Starts the stub on a background thread; port=0 picks a free port.
+
+    The returned server has .url (pass it as LocalMalwareScanner(host=...)),
+    .requests (count served so far) and .shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), _ChatHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.verdict = verdict or STUB_VERDICT
+    server.batch = batch
+    server.reply = reply
+    server.requests = 0
+    server.url = f"http://{host}:{server.server_address[1]}"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("ollama_stub")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait per request")
+    parser.add_argument("--no-batch", action="store_true", help="Answer batched prompts with a single verdict")
+    parser.add_argument("--reply", help="Raw text to answer single prompts with instead of the verdict")
+    args = parser.parse_args()
+
+    server = start_stub_server(port=args.port, delay=args.delay, batch=not args.no_batch, reply=args.reply)
+    print(f"[*] Stub Ollama listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,411 @@
+"""Single streaming pass over an OOXML package.
+
+SFEM_Analyzer (structural paths) and Office2JSON (content dict) used to open
+and inflate every document on their own. scan_document walks the zip once:
+each member is decompressed as a stream, XML parts are fed chunk by chunk to
+an incremental lxml parser so no part is ever held as a full element tree,
+and the same bytes are kept for the content dict only when the caller asks.
+"""
+import re
+from functools import lru_cache
+from lxml import etree
+
+from Office2JSON import open_zip, part_has_content, read_part_content, insert_part
+from resource_limits import MAX_DEPTH, DEFAULT_LIMITS, ArchiveBudget, check_directory
+
+NAMESPACES = {
+    'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'p': 'http://schemas.openxmlformats.org/presentationml/2006/main',
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+}
+
+XML_PARTS = (".xml", ".rels")
+CHUNK_SIZE = 64 * 1024
+
+
+# namespace-url -> 'prefix:' so clean_tag is one dict lookup, not a scan of NAMESPACES
+_PREFIX_BY_URL = {url: f"{prefix}:" for prefix, url in NAMESPACES.items()}
+_CLEAN_TAGS = {}  # memo: the same few hundred tags come up in every document
+_CLEAN_TAGS_MAX = 100000
+
+
+def clean_tag(tag):
+    """'{namespace-url}name' -> 'prefix:name' for the known namespaces, bare name otherwise"""
+    cleaned = _CLEAN_TAGS.get(tag)
+    if cleaned is not None:
+        return cleaned
+    if '}' in tag:
+        ns_url, _, tag_name = tag[1:].partition('}')
+        cleaned = _PREFIX_BY_URL.get(ns_url, "") + tag_name
+    else:
+        cleaned = tag
+    if len(_CLEAN_TAGS) < _CLEAN_TAGS_MAX:
+        _CLEAN_TAGS[tag] = cleaned
+    return cleaned
+
+
+class PathVocabulary:
+    """Interned SFEM paths: every distinct path gets a small integer id.
+
+    It's a trie keyed by (parent id, raw tag): the 'parent\\tag' string is
+    built and cleaned once per distinct path for the life of the process, and
+    documents keep sets of ids that all point at the same string objects.
+    Ids only mean something within one vocabulary (one process for the
+    global one); pass path strings between processes.
+    """
+
+    def __init__(self, paths=()):
+        self.paths = []     # id -> path
+        self._ids = {}      # path -> id
+        self._children = {}  # (parent id, raw tag) -> id
+        for path in paths:
+            self.intern(path)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def intern(self, path):
+        path_id = self._ids.get(path)
+        if path_id is None:
+            path_id = self._ids[path] = len(self.paths)
+            self.paths.append(path)
+        return path_id
+
+    def child(self, parent_id, tag):
+        """Id of the path of element `tag` (as lxml reports it) under parent_id"""
+        key = (parent_id, tag)
+        child_id = self._children.get(key)
+        if child_id is None:
+            child_id = self._children[key] = self.intern(f"{self.paths[parent_id]}\\{clean_tag(tag)}")
+        return child_id
+
+    def decode(self, path_ids):
+        paths = self.paths
+        return {paths[i] for i in path_ids}
+
+
+_vocabulary = PathVocabulary()
+
+
+def get_vocabulary():
+    """The process-wide vocabulary scan_document and sieve_document intern into"""
+    return _vocabulary
+
+
+# Structural markers that send a file on to the model
+DEFAULT_TRIGGERS = ("vbaProject.bin", "macrosheets", "activeX", "oleObject", "w:fldSimple")
+
+# Where a trigger's elements usually are (XML part name prefixes). Only an
+# ordering hint: tier 1 parses these parts first so a flagged file stops
+# early, but a file is only cleared once every XML part has been parsed
+# (the main document can live anywhere _rels/.rels points to).
+TRIGGER_LIKELY_PARTS = {
+    "oleObject": ("xl/worksheets/", "xl/dialogsheets/"),  # <oleObjects><oleObject>
+    "w:fldSimple": ("word/",),
+}
+
+
+class TriggerMatcher:
+    """All sieve triggers folded into one compiled regex (plain substring semantics).
+
+    likely_prefixes is the union of the triggers' likely parts (see
+    TRIGGER_LIKELY_PARTS); parse_order puts those parts first.
+    """
+
+    def __init__(self, triggers, likely_parts=TRIGGER_LIKELY_PARTS):
+        self.triggers = tuple(triggers)
+        self._regex = re.compile("|".join(re.escape(t) for t in self.triggers))
+
+        prefixes = set()
+        for trigger in self.triggers:
+            prefixes.update(likely_parts.get(trigger, ()))
+        self.likely_prefixes = tuple(sorted(prefixes))
+
+    def parse_order(self, infos):
+        """infos with the parts a trigger most likely sits in first (stable otherwise)"""
+        if not self.likely_prefixes:
+            return list(infos)
+        return sorted(infos, key=lambda info: not info.filename.startswith(self.likely_prefixes))
+
+    def search(self, path):
+        """The first trigger found in path, or None"""
+        if not self.triggers:
+            return None
+        match = self._regex.search(path)
+        return match.group(0) if match else None
+
+
+@lru_cache(maxsize=32)
+def get_matcher(triggers):
+    """Compiled matcher for a tuple of triggers, built once per process"""
+    return TriggerMatcher(triggers)
+
+
+class DocumentScan:
+    """Result of scan_document / sieve_document: the SFEM path set plus the
+    Office2JSON-style content dict.
+
+    From sieve_document: trigger is the first hit (None if clean), tier is
+    the sieve tier that decided (0 = central directory, 1 = XML parsing) and
+    directory holds the central-directory stats tier 0 looked at.
+    parts_read / bytes_read count what was actually decompressed.
+    scan_document fills directory too, and part_sizes (member -> uncompressed size).
+    limits maps each ScanLimits cap that fired to the part it fired in.
+    """
+
+    def __init__(self):
+        self.path_ids = set()  # ids in get_vocabulary()
+        self.content = {}
+        self.part_sizes = {}
+        self.trigger = None
+        self.tier = None
+        self.directory = None
+        self.parts_read = 0  # members actually inflated
+        self.bytes_read = 0  # decompressed bytes read from them
+        self.elements = 0    # start tags parsed
+        self.xml_bytes = 0   # bytes fed to the XML parser
+        self.limits = {}
+
+    @property
+    def exhausted(self):
+        """True once an element or byte cap has fired: no more XML gets parsed"""
+        return "elements" in self.limits or "xml_bytes" in self.limits
+
+    @property
+    def paths(self):
+        """The path set as strings"""
+        return _vocabulary.decode(self.path_ids)
+
+
+class _TriggerFound(Exception):
+    def __init__(self, trigger):
+        self.trigger = trigger
+
+
+class _LimitReached(Exception):
+    def __init__(self, limit):
+        self.limit = limit
+
+
+class _PathCollector:
+    """lxml parser target: collects the path ids of 'root_path\\tag\\child...' from start/end events.
+
+    No element tree is ever built, so memory stays flat however big the part
+    is, and the traversal is driven by parser events, not recursion. Repeated
+    siblings (the millions of c/v cells of a big sheet) resolve to a known id
+    with one dict lookup and skip the set insert and trigger check.
+    """
+
+    def __init__(self, root_id, matcher=None, max_depth=MAX_DEPTH, elements_left=None):
+        self.stack = [root_id]
+        self.path_ids = set()
+        self.matcher = matcher
+        self.max_depth = max_depth
+        self.elements_left = elements_left
+        self.elements = 0
+        self._children = _vocabulary._children
+
+    def start(self, tag, attrib, nsmap=None):
+        self.elements += 1
+        if self.elements_left is not None and self.elements > self.elements_left:
+            raise _LimitReached("elements")
+        if self.max_depth is not None and len(self.stack) > self.max_depth:
+            raise _LimitReached("depth")
+
+        parent = self.stack[-1]
+        path_id = self._children.get((parent, tag))
+        if path_id is None:
+            path_id = _vocabulary.child(parent, tag)
+        if path_id not in self.path_ids:
+            if self.matcher is not None:
+                trigger = self.matcher.search(_vocabulary.paths[path_id])
+                if trigger:
+                    raise _TriggerFound(trigger)
+            self.path_ids.add(path_id)
+        self.stack.append(path_id)
+
+    def end(self, tag):
+        self.stack.pop()
+
+    def close(self):
+        return self.path_ids
+
+
+def _stream_part(stream, root_id, is_xml, keep, scan, limits, part_name, matcher=None):
+    """Reads one member chunk by chunk, feeding XML parts to an incremental parser.
+
+    Returns (path_ids, data): path_ids is None when the part isn't well-formed XML
+    (or isn't XML at all, or is too deep), data is b"" unless keep is set.
+    Parsed elements and bytes are charged to scan against limits; a cap that
+    fires is recorded in scan.limits. With a matcher, _TriggerFound is raised
+    as soon as an element path hits a trigger.
+    """
+    collector = parser = None
+    if is_xml and not scan.exhausted:
+        elements_left = None
+        if limits.max_elements is not None:
+            elements_left = limits.max_elements - scan.elements
+        collector = _PathCollector(root_id, matcher, limits.max_depth, elements_left)
+        parser = etree.XMLParser(target=collector)
+    chunks = []
+    paths = None
+
+    def limit_reached(limit):
+        scan.limits.setdefault(limit, part_name)
+        # depth keeps libxml2's behaviour (part dropped); the others keep what was found
+        return None if limit == "depth" else collector.path_ids
+
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if keep:
+            chunks.append(chunk)
+        if parser is not None:
+            if limits.max_xml_bytes is not None and scan.xml_bytes + len(chunk) > limits.max_xml_bytes:
+                paths = limit_reached("xml_bytes")
+                parser = None
+            else:
+                scan.xml_bytes += len(chunk)
+                try:
+                    parser.feed(chunk)
+                except etree.XMLSyntaxError:
+                    parser = None
+                except _LimitReached as hit:
+                    paths = limit_reached(hit.limit)
+                    parser = None
+        if parser is None and not keep:
+            break
+
+    if parser is not None:
+        try:
+            paths = parser.close()
+        except etree.XMLSyntaxError:
+            pass
+        except _LimitReached as hit:
+            paths = limit_reached(hit.limit)
+    if collector is not None:
+        scan.elements += collector.elements
+
+    return paths, b"".join(chunks)
+
+
+def scan_document(source, with_content=True, scan=None, limits=DEFAULT_LIMITS):
+    """Streams every member of the package once and returns a DocumentScan.
+
+    source is anything Office2JSON.open_zip takes: a path, bytes or a file/mmap.
+
+    Errors from zipfile (bad archives, CRC mismatches) are raised as-is; pass
+    in your own DocumentScan to keep whatever was collected before that.
+    XML parsing is bounded by limits (see resource_limits.ScanLimits); caps
+    that fired are reported in scan.limits rather than raised. A package over
+    the decompression caps raises ResourceLimitExceeded.
+    """
+    if scan is None:
+        scan = DocumentScan()
+
+    with open_zip(source) as z:
+        infos = z.infolist()
+        scan.directory = _directory_stats(infos)
+        check_directory(infos, limits)
+        budget = ArchiveBudget(limits)
+        for info in infos:
+            name = info.filename
+            path_id = _vocabulary.intern(name.replace('/', '\\'))
+            scan.path_ids.add(path_id)
+            scan.part_sizes[name] = info.file_size
+
+            # Past a ScanLimits cap, XML parts only contribute their names
+            is_xml = name.endswith(XML_PARTS) and not scan.exhausted
+            keep = with_content and part_has_content(name)
+
+            if info.is_dir():
+                if with_content:
+                    insert_part(scan.content, name, None)
+                continue
+
+            data = b""
+            if is_xml or keep:
+                with budget.open(z, info) as stream:
+                    try:
+                        part_paths, data = _stream_part(stream, path_id, is_xml, keep,
+                                                        scan, limits, name)
+                    finally:
+                        scan.parts_read += 1
+                        scan.bytes_read += stream.tell()
+                if part_paths:
+                    scan.path_ids.update(part_paths)
+
+            if with_content:
+                insert_part(scan.content, name, read_part_content(name, data))
+
+    return scan
+
+
+def _directory_stats(infos):
+    compressed = sum(info.compress_size for info in infos)
+    uncompressed = sum(info.file_size for info in infos)
+    max_ratio = max((info.file_size / info.compress_size
+                     for info in infos if info.compress_size), default=0.0)
+    return {
+        "members": len(infos),
+        "compressed_bytes": compressed,
+        "uncompressed_bytes": uncompressed,
+        "max_ratio": round(max_ratio, 1),
+    }
+
+
+def sieve_document(source, matcher, scan=None, limits=DEFAULT_LIMITS):
+    """Tiered sieve; returns a DocumentScan with trigger and tier set.
+
+    Tier 0 reads only the central directory: a part name that hits a trigger
+    flags the file, and a file with no XML part at all is cleared without
+    inflating anything. Otherwise (e.g. w:fldSimple is an element) tier 1
+    parses every XML part, the likely ones first, stopping at the first hit.
+    scan.path_ids is only what the deciding tier needed to look at.
+    Packages over the decompression caps raise ResourceLimitExceeded.
+    """
+    if scan is None:
+        scan = DocumentScan()
+
+    with open_zip(source) as z:
+        infos = z.infolist()
+
+        # Tier 0: names and sizes from the central directory
+        scan.tier = 0
+        scan.directory = _directory_stats(infos)
+        check_directory(infos, limits)
+        for info in infos:
+            path_str = info.filename.replace('/', '\\')
+            scan.path_ids.add(_vocabulary.intern(path_str))
+            scan.trigger = matcher.search(path_str)
+            if scan.trigger:
+                return scan
+
+        to_parse = matcher.parse_order(info for info in infos
+                                       if not info.is_dir() and info.filename.endswith(XML_PARTS))
+        if not to_parse:
+            return scan
+
+        # Tier 1: the namelist is ambiguous, look inside every XML part
+        scan.tier = 1
+        budget = ArchiveBudget(limits)
+        for info in to_parse:
+            if scan.exhausted:
+                break
+            path_id = _vocabulary.intern(info.filename.replace('/', '\\'))
+            with budget.open(z, info) as stream:
+                try:
+                    part_paths, _ = _stream_part(stream, path_id, True, False,
+                                                 scan, limits, info.filename, matcher)
+                except _TriggerFound as hit:
+                    scan.trigger = hit.trigger
+                    return scan
+                finally:
+                    scan.parts_read += 1
+                    scan.bytes_read += stream.tell()
+            if part_paths:
+                scan.path_ids.update(part_paths)
+
+    return scan
@@ -0,0 +1,56 @@
+"""NumPy representations of SFEM path sets.
+
+With paths interned in a PathVocabulary (ooxml_stream.get_vocabulary(), or
+the feature store's), a document's structure is a sorted uint32 array of
+path ids, or a bitset over the vocabulary. Across thousands of documents
+the usual questions become array operations:
+
+    arrays = [to_array(sfem.path_ids) for sfem in analyzers]
+    counts = path_counts(arrays, len(vocab))        # documents per path
+    m = path_matrix(arrays, len(vocab))             # docs x paths, bool
+    rare = np.flatnonzero((counts > 0) & (counts < 3))
+"""
+import numpy as np
+
+ID_DTYPE = np.uint32
+
+
+def to_array(path_ids):
+    """Sorted, unique id array"""
+    return np.unique(np.fromiter(path_ids, dtype=ID_DTYPE))
+
+
+def to_bitset(path_ids, size):
+    """Packed bitset of `size` bits (size = vocabulary length), 1 bit per path"""
+    bits = np.zeros(size, dtype=bool)
+    bits[np.fromiter(path_ids, dtype=ID_DTYPE)] = True
+    return np.packbits(bits)
+
+
+def from_bitset(bitset, size):
+    return np.flatnonzero(np.unpackbits(bitset, count=size)).astype(ID_DTYPE)
+
+
+def path_matrix(arrays, size):
+    """Documents x vocabulary boolean matrix"""
+    matrix = np.zeros((len(arrays), size), dtype=bool)
+    for row, ids in enumerate(arrays):
+        matrix[row, ids] = True
+    return matrix
+
+
+def path_counts(arrays, size):
+    """How many documents contain each path id"""
+    if not arrays:
+        return np.zeros(size, dtype=np.int64)
+    return np.bincount(np.concatenate(arrays).astype(np.int64), minlength=size)
+
+
+def diff(a, b):
+    """(only in a, only in b) for two sorted id arrays"""
+    return np.setdiff1d(a, b, assume_unique=True), np.setdiff1d(b, a, assume_unique=True)
+
+
+def jaccard(a, b):
+    union = np.union1d(a, b).size
+    return np.intersect1d(a, b, assume_unique=True).size / union if union else 1.0
@@ -0,0 +1,272 @@
+"""Cheap structural classifier in front of the LLM.
+
+Every file that trips the sieve used to go to Ollama, seconds per file, even
+when its structure alone settles the question. PreClassifier is a logistic
+regression over path presence: each document is the set of its SFEM paths
+(numbered parts folded, slide3.xml -> slide#.xml) within a vocabulary of
+paths seen in at least `min_df` training documents. Scoring a document is a
+sum of the weights of the paths it has, no matrix needed:
+
+    clf = PreClassifier.load()
+    p, decision = clf.decide(paths)   # decision: "malicious", "clean" or None
+    if decision is None:
+        verdict = analyst.analyze(content, paths)   # uncertain band: ask the LLM
+
+Probabilities at or above `high` or at or below `low` are decided here;
+everything in between is deferred to the LLM. It only ever sees files the
+sieve flagged, so it is trained on those too: labels.csv decides the
+samples and their labels, the feature store (built first if needed)
+supplies the paths, and files the sieve would clear are left out:
+
+    python src/pre_classifier.py train
+    python src/pre_classifier.py train --low 0.05 --high 0.95
+
+Training holds out a fifth of the samples (by hash) and reports the
+deferral rate and the accuracy of the decided files on them, then refits on
+everything and saves data/pre_classifier.npz.
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from ooxml_stream import DEFAULT_TRIGGERS, get_matcher
+from prompt_builder import fold_part_numbers
+from verdicts import Verdict
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+DEFAULT_MODEL_FILE = os.path.join(PROJECT_ROOT, "data", "pre_classifier.npz")
+LABELS_FILE = os.path.join(PROJECT_ROOT, "data", "labels.csv")
+
+DEFAULT_LOW = 0.1
+DEFAULT_HIGH = 0.9
+MIN_DF = 2  # paths in fewer training documents are not features
+L2 = 1e-3
+EPOCHS = 400
+LEARNING_RATE = 0.5
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def fit_logistic(X, y, l2=L2, epochs=EPOCHS, lr=LEARNING_RATE):
+    """Weights and bias by full-batch gradient descent (Adam steps), classes
+    weighted to balance; X is documents x features (0/1), y is 0/1"""
+    n, d = X.shape
+    pos = max(int(y.sum()), 1)
+    sample_w = np.where(y == 1, n / (2.0 * pos), n / (2.0 * max(n - pos, 1))).astype(np.float32)
+
+    w = np.zeros(d, dtype=np.float32)
+    b = 0.0
+    m_w, v_w = np.zeros_like(w), np.zeros_like(w)
+    m_b = v_b = 0.0
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for t in range(1, epochs + 1):
+        err = (_sigmoid(X @ w + b) - y) * sample_w / n
+        g_w = X.T @ err + l2 * w
+        g_b = float(err.sum())
+
+        m_w = beta1 * m_w + (1 - beta1) * g_w
+        v_w = beta2 * v_w + (1 - beta2) * g_w * g_w
+        m_b = beta1 * m_b + (1 - beta1) * g_b
+        v_b = beta2 * v_b + (1 - beta2) * g_b * g_b
+        scale = lr * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
+        w -= scale * m_w / (np.sqrt(v_w) + eps)
+        b -= scale * m_b / (np.sqrt(v_b) + eps)
+    return w, b
+
+
+class PreClassifier:
+    """Path vocabulary + logistic weights + the deferral band (low, high)"""
+
+    def __init__(self, paths, weights, bias, low=DEFAULT_LOW, high=DEFAULT_HIGH):
+        self.paths = list(paths)
+        self.index = {path: i for i, path in enumerate(self.paths)}
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.low = low
+        self.high = high
+
+    # --- features ---
+
+    @staticmethod
+    def fold(paths):
+        return {fold_part_numbers(p) for p in paths}
+
+    def feature_ids(self, paths):
+        index = self.index
+        return np.fromiter({index[p] for p in self.fold(paths) if p in index}, dtype=np.int64)
+
+    def matrix(self, path_sets):
+        """Documents x vocabulary 0/1 matrix (for training and evaluation)"""
+        X = np.zeros((len(path_sets), len(self.paths)), dtype=np.float32)
+        for row, paths in enumerate(path_sets):
+            X[row, self.feature_ids(paths)] = 1.0
+        return X
+
+    # --- inference ---
+
+    def predict_proba(self, paths):
+        """P(malicious) for one document's SFEM paths"""
+        return float(_sigmoid(self.bias + self.weights[self.feature_ids(paths)].sum()))
+
+    def predict_many(self, path_sets):
+        return _sigmoid(self.matrix(path_sets) @ self.weights + self.bias)
+
+    def decide(self, paths):
+        """(p, "malicious" | "clean" | None); None means defer to the LLM"""
+        p = self.predict_proba(paths)
+        if p >= self.high:
+            return p, "malicious"
+        if p <= self.low:
+            return p, "clean"
+        return p, None
+
+    def explain(self, paths, top=3):
+        """The paths pushing hardest towards the document's side"""
+        ids = self.feature_ids(paths)
+        if ids.size == 0:
+            return []
+        w = self.weights[ids]
+        sign = 1 if self.bias + w.sum() >= 0 else -1
+        order = np.argsort(-sign * w)[:top]
+        return [self.paths[ids[i]] for i in order if sign * w[i] > 0]
+
+    def verdict(self, paths, p, decision):
+        """Same JSON shape as the model's verdicts (score 0-10)"""
+        evidence = "; ".join(self.explain(paths))
+        # p is P(malicious); a clean decision reports the benign side, 1 - p
+        likely = f"{p:.0%} likely malicious" if decision == "malicious" else f"{1 - p:.0%} likely benign"
+        reason = (f"Pre-classifier: {likely} from its structure alone, AI skipped."
+                  + (f" Strongest paths: {evidence}" if evidence else ""))
+        return Verdict(round(10 * p, 1), reason).to_json()
+
+    # --- persistence ---
+
+    @classmethod
+    def train(cls, path_sets, labels, low=DEFAULT_LOW, high=DEFAULT_HIGH, min_df=MIN_DF):
+        """labels: 1 = malicious, 0 = benign"""
+        counts = {}
+        for paths in path_sets:
+            for path in cls.fold(paths):
+                counts[path] = counts.get(path, 0) + 1
+        vocab = sorted(p for p, c in counts.items() if c >= min_df)
+
+        clf = cls(vocab, np.zeros(len(vocab), dtype=np.float32), 0.0, low, high)
+        clf.weights, clf.bias = fit_logistic(clf.matrix(path_sets), np.asarray(labels, dtype=np.float32))
+        return clf
+
+    def save(self, path=DEFAULT_MODEL_FILE):
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, paths=np.array(self.paths, dtype=np.str_), weights=self.weights,
+                            bias=self.bias, low=self.low, high=self.high)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_FILE, low=None, high=None):
+        """low/high override the band the model was saved with"""
+        with np.load(path) as data:
+            return cls(data["paths"].tolist(), data["weights"], float(data["bias"]),
+                       float(data["low"]) if low is None else low,
+                       float(data["high"]) if high is None else high)
+
+
+def evaluate(clf, path_sets, labels):
+    """Deferral rate and accuracy of the decided files"""
+    p = clf.predict_many(path_sets)
+    labels = np.asarray(labels)
+    decided = (p >= clf.high) | (p <= clf.low)
+    correct = (p >= clf.high) == (labels == 1)
+    return {
+        "files": int(labels.size),
+        "deferred": int((~decided).sum()),
+        "deferral_rate": float((~decided).mean()) if labels.size else 0.0,
+        "decided_accuracy": float(correct[decided].mean()) if decided.any() else None,
+        "accuracy": float(((p >= 0.5) == (labels == 1)).mean()) if labels.size else None,
+    }
+
+
+def _load_training_set(store_dir, workers, labels_file=LABELS_FILE, triggers=DEFAULT_TRIGGERS):
+    """(hashes, path_sets, labels) of the flagged, labelled samples.
+
+    Like build_dataset.build_from_store, the current labels.csv decides
+    membership and labels (each filename once, its last row's label); the
+    label saved in the store may be stale. Store rows are matched by the
+    row's sha256, or else by filename, and each content is used once."""
+    from feature_store import FeatureStore, build, iter_labelled_files
+
+    store = FeatureStore(store_dir)
+    added, _ = build(store, iter_labelled_files(labels_file), workers)
+    if added:
+        print(f"[*] Feature store: extracted {added} new files")
+
+    labels_by_name = {}  # filename -> (sha256, label), in first-seen order
+    with open(labels_file, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get('filename') and row.get('label') in ("Malicious", "Benign"):
+                labels_by_name[row['filename']] = (row.get('sha256'), row['label'])
+
+    rows = store.read(["sha256", "filename", "path_ids", "error"])
+    rows = rows[rows["error"].isna()]
+    by_sha = {row.sha256: row for row in rows.itertuples()}
+    by_name = {row.filename: row for row in by_sha.values()}
+
+    samples = {}  # store sha256 -> (path set, 0/1)
+    for filename, (sha256, label) in labels_by_name.items():
+        row = by_sha.get(sha256) or by_name.get(filename)
+        if row is not None:
+            samples[row.sha256] = (row.path_ids, int(label == "Malicious"))
+
+    # The sieve's decision from the full path set (what tier 1 would find)
+    matcher = get_matcher(tuple(triggers))
+    hashes, path_sets, labels = [], [], []
+    for sha256, (path_ids, label) in samples.items():
+        paths = store.decode_paths(path_ids)
+        if any(matcher.search(p) for p in paths):
+            hashes.append(sha256)
+            path_sets.append(paths)
+            labels.append(label)
+    print(f"[*] {len(samples)} labelled files in the store, {len(samples) - len(labels)} cleared by the sieve")
+    return hashes, path_sets, labels
+
+
+def main():
+    parser = argparse.ArgumentParser("pre_classifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="Train from labels.csv via the feature store")
+    train.add_argument("--store", default=None, help="Feature store directory (default: data/features)")
+    train.add_argument("--out", default=DEFAULT_MODEL_FILE)
+    train.add_argument("--low", type=float, default=DEFAULT_LOW, help="Decide 'clean' at or below this")
+    train.add_argument("--high", type=float, default=DEFAULT_HIGH, help="Decide 'malicious' at or above this")
+    train.add_argument("--min-df", type=int, default=MIN_DF)
+    train.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    from feature_store import DEFAULT_STORE_DIR
+    hashes, path_sets, labels = _load_training_set(args.store or DEFAULT_STORE_DIR, args.workers)
+    print(f"[*] {len(labels)} samples ({sum(labels)} malicious)")
+
+    # Hold out a fifth, chosen by hash so reruns use the same split
+    held = [int(h[:8], 16) % 5 == 0 for h in hashes]
+    train_idx = [i for i, h in enumerate(held) if not h]
+    test_idx = [i for i, h in enumerate(held) if h]
+    clf = PreClassifier.train([path_sets[i] for i in train_idx], [labels[i] for i in train_idx],
+                              args.low, args.high, args.min_df)
+    report = evaluate(clf, [path_sets[i] for i in test_idx], [labels[i] for i in test_idx])
+
+    def percent(value):
+        return "n/a" if value is None else f"{value:.1%}"
+    print(f"[*] Held out {report['files']} files: deferral rate {report['deferral_rate']:.1%}, "
+          f"decided accuracy {percent(report['decided_accuracy'])}, "
+          f"accuracy at 0.5 {percent(report['accuracy'])}")
+
+    clf = PreClassifier.train(path_sets, labels, args.low, args.high, args.min_df)
+    clf.save(args.out)
+    print(f"[+] Saved {len(clf.paths)} path weights to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
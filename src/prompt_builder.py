@@ -0,0 +1,248 @@
+"""Token-budgeted prompt assembly for LocalMalwareScanner and build_dataset.
+
+The old prompt was json.dumps(indent=2) of the first 60 sorted paths plus
+every part of the document. Most of that is indentation, namespace
+boilerplate and styles/themes/cell data, and the first sorted paths are
+rarely the interesting ones. PromptBuilder instead:
+
+  * serializes compactly (no indentation),
+  * ranks evidence: trigger hits, VBA, OLE/ActiveX objects and external
+    relationships first, field codes next, everything else last,
+  * keeps only leaf paths, with numbered parts (slide1, slide2...) folded
+    into one 'slide#' entry,
+  * trims XML boilerplate and summarizes bulky benign parts to a short
+    head, dropping them entirely once the budget runs out,
+  * never goes over max_chars (measured on the serialized, escaped JSON,
+    so the context is always a whole document), and reports what it kept.
+"""
+import json
+import re
+from collections.abc import Mapping
+
+from ooxml_stream import DEFAULT_TRIGGERS
+
+CHARS_PER_TOKEN = 4  # rough, for reporting
+DEFAULT_MAX_CHARS = 24000  # ~6k tokens of context
+PATH_SHARE = 0.3  # of the budget reserved for structural paths (unused share goes to content)
+SUMMARY_CHARS = 300  # head kept from a bulky low-priority part
+
+# Worth showing the model even without a trigger hit
+EVIDENCE_KEYWORDS = (
+    "External", "oleObj", "OLEObject", "embeddings", "control", "activeX", "ocx",
+    "instrText", "fldChar", "fldSimple", "ddeLink", "externalLink", "attachedTemplate",
+    "vba", "macro", "binaryData", "hyperlink",
+)
+_EVIDENCE_RE = re.compile("|".join(re.escape(k) for k in EVIDENCE_KEYWORDS), re.IGNORECASE)
+_PART_NUMBER_RE = re.compile(r"(?<=[A-Za-z])\d+(?=\.(?:xml|bin|rels|vml)\b)")
+_BOILERPLATE_RE = re.compile(r"<\?xml[^>]*\?>|\s+xmlns(?::\w+)?='[^']*'|\s+mc:Ignorable='[^']*'")
+_EXTERNAL_REL_RE = re.compile(r"<Relationship\b[^>]*TargetMode='External'[^>]*/?>")
+_FIELD_RE = re.compile(r"<w:(?:fldSimple|instrText)\b[^>]*>(?:[^<]*)", re.IGNORECASE)
+
+
+def fold_part_numbers(path):
+    """slide3.xml -> slide#.xml, so numbered parts of one kind share a path"""
+    return _PART_NUMBER_RE.sub("#", path)
+
+
+def compact_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _clip(text, limit):
+    if len(text) <= limit:
+        return text
+    if limit <= 20:
+        return ""
+    return text[:limit - 20] + f"...[+{len(text) - limit + 20} chars]"
+
+
+def _clip_json(text, limit):
+    """_clip to at most limit chars once JSON-encoded (quotes and escapes included)"""
+    size = limit - 2
+    while True:
+        clipped = _clip(text, size)
+        excess = len(compact_json(clipped)) - limit
+        if excess <= 0 or not clipped:
+            return clipped
+        size -= excess
+
+
+def _entry_cost(name, value_chars):
+    """Chars one "name":value member adds to the evidence object (comma included)"""
+    return len(compact_json(name)) + 2 + value_chars
+
+
+def _fit_vba(value, room):
+    """A VBA summary cut down to at most room chars of JSON: analysis entries
+    first, then whole macros, the last one with its code clipped. None if
+    not even the empty shape fits."""
+    fitted = {"macros": [], "analysis": []}
+    if len(compact_json(fitted)) > room:
+        return None
+    for key in ("analysis", "macros"):
+        for item in value.get(key) or []:
+            fitted[key].append(item)
+            over = len(compact_json(fitted)) - room
+            if over <= 0:
+                continue
+            code = item.get("code") if key == "macros" else None
+            if code:
+                clipped = dict(item, code=_clip_json(code, len(compact_json(code)) - over))
+                fitted[key][-1] = clipped
+                if clipped["code"] and len(compact_json(fitted)) <= room:
+                    return fitted
+            fitted[key].pop()
+            return fitted
+    return fitted
+
+
+def _flatten(content, prefix=""):
+    """Nested Office2JSON dict (or Office2JSON.LazyContent) -> (part_name, value)
+    pairs, one at a time; VBA results stay whole"""
+    for key, value in content.items():
+        name = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, Mapping) and "macros" not in value:
+            yield from _flatten(value, name)
+        else:
+            yield name, value
+
+
+def _vba_summary(value):
+    """Just the macro code and olevba's findings from the olevba result dict"""
+    if not isinstance(value, dict):
+        return value
+    return {
+        "macros": [{"name": m.get("vba_filename"), "code": m.get("code")}
+                   for m in value.get("macros") or [] if m.get("code")],
+        "analysis": [{"type": a.get("type"), "keyword": a.get("keyword")}
+                     for a in value.get("analysis") or []],
+    }
+
+
+class PromptBuilder:
+    """Builds the CONTEXT block of the prompt under a hard character budget"""
+
+    def __init__(self, max_chars=DEFAULT_MAX_CHARS, triggers=DEFAULT_TRIGGERS):
+        self.max_chars = max_chars
+        self._trigger_re = re.compile("|".join(re.escape(t) for t in triggers)) if triggers else None
+
+    def _is_trigger(self, text):
+        return bool(self._trigger_re and self._trigger_re.search(text))
+
+    def rank_paths(self, sfem_paths):
+        """Leaf paths, numbered parts folded, ordered trigger hits > evidence > the rest"""
+        folded = sorted({fold_part_numbers(p) for p in sfem_paths})
+        leaves = [p for i, p in enumerate(folded)
+                  if i + 1 == len(folded) or not folded[i + 1].startswith(p + "\\")]
+
+        def rank(path):
+            if self._is_trigger(path):
+                return 0
+            if _EVIDENCE_RE.search(path):
+                return 1
+            return 2
+        return sorted(leaves, key=lambda p: (rank(p), len(p)))
+
+    def _rank_part(self, name, value):
+        """(priority, evidence) for one content part; lower priority goes in first"""
+        if name.endswith("vbaProject.bin"):
+            return 0, _vba_summary(value)
+        if not isinstance(value, str):
+            return 1, value
+
+        if name.endswith(".rels"):
+            external = _EXTERNAL_REL_RE.findall(value)
+            if external:
+                return 0, " ".join(external)
+        if self._is_trigger(name):
+            return 0, _BOILERPLATE_RE.sub("", value)
+        if value.startswith("*"):  # Office2JSON's placeholder for unknown / vml parts
+            return 1, value
+
+        fields = _FIELD_RE.findall(value)
+        if fields:
+            return 1, " ".join(fields)
+        if _EVIDENCE_RE.search(name):
+            return 1, _BOILERPLATE_RE.sub("", value)
+        return 2, _BOILERPLATE_RE.sub("", value)
+
+    def build_context(self, content_json, sfem_paths, report=None):
+        """The 'CONTEXT 1 / CONTEXT 2' text. If report is a dict it is filled
+        with the prompt size and what was kept, summarized or dropped."""
+        # 1. Structural paths, best first, up to their share of the budget
+        paths = self.rank_paths(sfem_paths or [])
+        path_budget = int(self.max_chars * PATH_SHARE)
+        kept_paths, used = [], 2
+        for path in paths:
+            cost = len(compact_json(path)) + 1  # backslashes are escaped
+            if used + cost > path_budget:
+                break
+            kept_paths.append(path)
+            used += cost
+        paths_str = compact_json(kept_paths)
+
+        # 2. Content parts in priority order with whatever budget is left
+        header = "\nCONTEXT 1: Structural Paths\n" + paths_str + "\n\nCONTEXT 2: Extracted Content\n"
+        budget = self.max_chars - len(header) - 2
+        # Parts are ranked as they are read, and bulky low-priority ones are
+        # cut to their summary right away, so only one whole part is held at
+        # a time (content_json may be a LazyContent reading parts on demand)
+        ranked = []
+        for name, value in _flatten(content_json or {}):
+            priority, value = self._rank_part(name, value)
+            summary = priority == 2 and isinstance(value, str) and len(value) > SUMMARY_CHARS
+            if summary:
+                value = _clip(value, SUMMARY_CHARS)
+            ranked.append((priority, value, name, summary))
+        ranked.sort(key=lambda r: r[0])
+
+        # Every cost is the entry's serialized length, so the object built
+        # below always fits: entries are trimmed or dropped whole, never cut
+        evidence, summarized, dropped = {}, 0, []
+        for priority, value, name, summary in ranked:
+            room = budget - _entry_cost(name, 0)
+            if room <= 20:
+                dropped.append(name)
+                continue
+            if not isinstance(value, str):
+                # VBA results stay structured, trimmed to whole entries if they don't fit
+                if len(compact_json(value)) > room:
+                    value = _fit_vba(value, room) if isinstance(value, dict) and "macros" in value else None
+                    if value is None or not (value["macros"] or value["analysis"]):
+                        dropped.append(name)
+                        continue
+                    summarized += 1
+                evidence[name] = value
+                budget -= _entry_cost(name, len(compact_json(value)))
+                continue
+            text = value
+            if summary:
+                summarized += 1
+            elif priority == 2 and len(text) > SUMMARY_CHARS:
+                text = _clip(text, SUMMARY_CHARS)
+                summarized += 1
+            text = _clip_json(text, room)
+            if not text:
+                dropped.append(name)
+                continue
+            evidence[name] = text
+            budget -= _entry_cost(name, len(compact_json(text)))
+
+        if dropped:
+            note = f"{len(dropped)} more parts omitted"
+            if _entry_cost("_omitted", len(compact_json(note))) <= budget:
+                evidence["_omitted"] = note
+
+        context = header + compact_json(evidence) + "\n"
+
+        if report is not None:
+            report.update({
+                "chars": len(context),
+                "tokens_est": len(context) // CHARS_PER_TOKEN,
+                "paths_included": len(kept_paths),
+                "paths_total": len(paths),
+                "parts_included": len(evidence) - ("_omitted" in evidence),
+                "parts_summarized": summarized,
+                "parts_dropped": len(dropped),
+            })
+        return context
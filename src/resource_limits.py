@@ -0,0 +1,166 @@
+"""Resource caps for reading untrusted OOXML packages.
+
+Two kinds of limit:
+
+  * soft, on XML parsing (depth, element count, parsed bytes): the scan
+    stops parsing and reports which cap fired in DocumentScan.limits
+  * hard, on decompression (per-member bytes, per-archive bytes, compression
+    ratio): the file is refused with ResourceLimitExceeded, which callers
+    turn into a "resource limit" verdict (error-style, score -1, with the
+    limit attached; see Model.resource_limit_verdict)
+
+Hard caps are checked twice: against the sizes the central directory
+declares, before anything is inflated, and against the bytes actually read
+while streaming, so a member that lies about its size is stopped as well.
+"""
+
+# libxml2 refuses trees deeper than this when parsing a whole document, the
+# push parser doesn't, so we enforce it ourselves to keep the same results
+MAX_DEPTH = 256
+# Per-document caps on XML parsing; the largest samples in data/ are ~600k
+# elements and ~15 MB of XML, so these only stop hostile or absurd files
+MAX_ELEMENTS = 5_000_000
+MAX_XML_BYTES = 256 * 1024 * 1024
+
+# Decompression caps; the largest sample member is ~13 MB, the largest package ~15 MB
+MAX_MEMBER_BYTES = 256 * 1024 * 1024
+MAX_ARCHIVE_BYTES = 1024 * 1024 * 1024
+# Deflate tops out near 1032:1. Small parts (poc-xmlbomb.xlsx has ~400:1)
+# are harmless, so the ratio is only checked on members of RATIO_MIN_BYTES+
+MAX_RATIO = 100
+RATIO_MIN_BYTES = 16 * 1024 * 1024
+
+
+class ScanLimits:
+    """Caps for scan_document / sieve_document / extract_json (None = no cap).
+
+    max_depth:          deeper parts are treated as malformed (their paths are
+                        dropped), like libxml2's own limit
+    max_elements:       start tags across all parts of the document
+    max_xml_bytes:      decompressed bytes fed to the XML parser across all parts
+    max_member_bytes:   decompressed size of any one member
+    max_archive_bytes:  decompressed size of all members together
+    max_ratio:          uncompressed / compressed size of a member, for
+                        members of at least ratio_min_bytes
+
+    When the element or XML byte cap is reached, the part being parsed keeps
+    the paths found so far and no further XML is parsed for that document.
+    The member, archive and ratio caps raise ResourceLimitExceeded.
+    """
+
+    def __init__(self, max_depth=MAX_DEPTH, max_elements=MAX_ELEMENTS, max_xml_bytes=MAX_XML_BYTES,
+                 max_member_bytes=MAX_MEMBER_BYTES, max_archive_bytes=MAX_ARCHIVE_BYTES,
+                 max_ratio=MAX_RATIO, ratio_min_bytes=RATIO_MIN_BYTES):
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.max_xml_bytes = max_xml_bytes
+        self.max_member_bytes = max_member_bytes
+        self.max_archive_bytes = max_archive_bytes
+        self.max_ratio = max_ratio
+        self.ratio_min_bytes = ratio_min_bytes
+
+
+DEFAULT_LIMITS = ScanLimits()
+
+
+class ResourceLimitExceeded(Exception):
+    """A hard cap refused the file; to_dict() is what goes into the verdict"""
+
+    def __init__(self, limit, member=None, detail=""):
+        super().__init__(f"{limit} limit exceeded" + (f" by {member}" if member else "")
+                         + (f": {detail}" if detail else ""))
+        self.limit = limit
+        self.member = member
+        self.detail = detail
+
+    def to_dict(self):
+        return {"limit": self.limit, "member": self.member, "detail": self.detail}
+
+
+def check_directory(infos, limits=DEFAULT_LIMITS):
+    """Refuses the package from its central directory alone, before inflating anything"""
+    total = 0
+    for info in infos:
+        size = info.file_size
+        if limits.max_member_bytes is not None and size > limits.max_member_bytes:
+            raise ResourceLimitExceeded("member_bytes", info.filename,
+                                        f"declares {size} bytes (cap {limits.max_member_bytes})")
+        if (limits.max_ratio is not None and limits.ratio_min_bytes is not None
+                and size >= limits.ratio_min_bytes):
+            ratio = size / max(info.compress_size, 1)
+            if ratio > limits.max_ratio:
+                raise ResourceLimitExceeded("ratio", info.filename,
+                                            f"{ratio:.0f}:1 (cap {limits.max_ratio}:1)")
+        total += size
+    if limits.max_archive_bytes is not None and total > limits.max_archive_bytes:
+        raise ResourceLimitExceeded("archive_bytes", None,
+                                    f"declares {total} bytes (cap {limits.max_archive_bytes})")
+
+
+class ArchiveBudget:
+    """Counts the bytes actually decompressed from one archive.
+
+    open(z, info) replaces z.open(info): the returned stream raises
+    ResourceLimitExceeded as soon as the member or the archive goes over
+    its cap, whatever the headers said.
+    """
+
+    def __init__(self, limits=DEFAULT_LIMITS):
+        self.limits = limits
+        self.total = 0
+
+    def open(self, z, info):
+        return _GuardedStream(z.open(info), info, self)
+
+    def charge(self, info, member_bytes, n):
+        self.total += n
+        limits = self.limits
+        if limits.max_member_bytes is not None and member_bytes > limits.max_member_bytes:
+            raise ResourceLimitExceeded("member_bytes", info.filename,
+                                        f"inflated past {limits.max_member_bytes} bytes")
+        if limits.max_archive_bytes is not None and self.total > limits.max_archive_bytes:
+            raise ResourceLimitExceeded("archive_bytes", info.filename,
+                                        f"inflated past {limits.max_archive_bytes} bytes")
+        if (limits.max_ratio is not None and limits.ratio_min_bytes is not None
+                and member_bytes >= limits.ratio_min_bytes
+                and member_bytes / max(info.compress_size, 1) > limits.max_ratio):
+            raise ResourceLimitExceeded("ratio", info.filename,
+                                        f"inflated past {limits.max_ratio}:1")
+
+
+class _GuardedStream:
+    """Read-only wrapper around a ZipExtFile that charges an ArchiveBudget"""
+
+    def __init__(self, stream, info, budget):
+        self.stream = stream
+        self.info = info
+        self.budget = budget
+        self.read_bytes = 0
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            # Unbounded read: go chunk by chunk so a cap can fire midway
+            chunks = []
+            while True:
+                chunk = self.read(64 * 1024)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+        data = self.stream.read(n)
+        if data:
+            self.read_bytes += len(data)
+            self.budget.charge(self.info, self.read_bytes, len(data))
+        return data
+
+    def tell(self):
+        return self.read_bytes
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
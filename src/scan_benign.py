@@ -1,6 +1,9 @@
 import os
-import csv
-import hashlib
+import argparse
+
+from file_index import FileIndex, DEFAULT_INDEX_FILE
+from labels_store import LabelsStore
+from verdict_cache import calculate_sha256
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -14,18 +17,52 @@ DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 BENIGN_DIR = os.path.join(DATA_DIR, "benign")
 LABELS_FILE = os.path.join(DATA_DIR, "labels.csv")
 
-# 1. Open CSV in append mode
-with open(LABELS_FILE, 'a', newline='') as f:
-    writer = csv.writer(f)
-    
+def log_benign(incremental=False, index_file=DEFAULT_INDEX_FILE):
+    """Appends the benign folder to labels.csv. With incremental=True only
+    files that are new or changed since the last incremental run are added."""
+    # With an index, only new or changed files (already hashed); otherwise everything
+    index = FileIndex(index_file) if incremental else None
+    changes = {}
+    if index is not None:
+        changes = {change.path: change for change in index.changes(BENIGN_DIR, "scan_benign")}
+        filepaths = list(changes)
+        print(f"[*] {len(filepaths)} new or changed file(s)")
+    else:
+        filepaths = [os.path.join(BENIGN_DIR, filename) for filename in os.listdir(BENIGN_DIR)]
+
+    # 1. Open the labels store (new rows are appended to labels.csv on close)
+    labels = LabelsStore(csv_path=LABELS_FILE)
+
     # 2. Loop through the benign folder
-    for filename in os.listdir(BENIGN_DIR):
-        filepath = os.path.join(BENIGN_DIR, filename)
+    for filepath in filepaths:
+        filename = os.path.basename(filepath)
         if os.path.isdir(filepath): continue
 
-        # 3. Calculate Hash
-        sha256 = hashlib.sha256(open(filepath, 'rb').read()).hexdigest()
-        
-        # 4. Write: Hash, Filename, "Benign", "Manual"
-        writer.writerow([sha256, filename, "Benign", "Manual"])
-        print(f"Added {filename}")
\ No newline at end of file
+        # 3. Calculate Hash (the index already did, for changed files)
+        change = changes.get(filepath)
+        if change is not None:
+            sha256 = change.sha256
+        else:
+            sha256 = calculate_sha256(filepath)
+
+        # 4. Add: Hash, Filename, "Benign", "Manual" (once per hash)
+        if labels.add(sha256, filename, "Benign", "Manual"):
+            print(f"Added {filename}")
+        else:
+            print(f"Skipped {filename} (already labelled)")
+
+        if change is not None:
+            index.mark("scan_benign", change)
+
+    labels.close()
+    if index is not None:
+        index.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("scan_benign")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only add files that are new or changed since the last incremental run")
+    parser.add_argument("--index", default=DEFAULT_INDEX_FILE, help="SQLite index used by --incremental")
+    args = parser.parse_args()
+    log_benign(args.incremental, args.index)
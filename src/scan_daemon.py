@@ -0,0 +1,433 @@
+"""Long-running scanner service for the mail gateway.
+
+Keeps a warm process pool (lxml, oletools and the sieve already imported in
+every worker), the Ollama client and the verdict cache alive between
+requests, and serves a small JSON API over localhost HTTP or a Unix socket:
+
+    POST /scan?name=invoice.docm     body = the document's bytes
+    POST /scan?path=/abs/file.docx   scan a file the daemon can read
+    GET  /health                     liveness, workers, uptime
+    GET  /queue                      requests waiting / being prepared / at the model
+    GET  /metrics                    Prometheus text (when started with --metrics)
+
+    python src/scan_daemon.py --port 8765
+    curl --data-binary @invoice.docm "http://127.0.0.1:8765/scan?name=invoice.docm"
+
+    python src/scan_daemon.py --socket /run/tsa/scan.sock
+    curl --unix-socket /run/tsa/scan.sock --data-binary @a.xlsx http://x/scan
+
+When more than --max-pending requests are in flight, /scan answers 503
+with Retry-After instead of queueing without bound.
+"""
+import argparse
+import hashlib
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from Model import LocalMalwareScanner
+from batch_scan import cacheable, pre_classify, prepare_file
+from llm_batch import DEFAULT_BATCH_SIZE, DEFAULT_MAX_WAIT, VerdictBatcher
+from metrics import enable as enable_metrics, get_metrics
+from pre_classifier import PreClassifier, DEFAULT_MODEL_FILE
+from similarity_index import SimilarityIndex, DEFAULT_INDEX_FILE as DEFAULT_SIMILARITY_FILE, DEFAULT_THRESHOLD, inherit
+from verdict_cache import VerdictCache, DEFAULT_CACHE_FILE, calculate_sha256
+from verdicts import VerdictSink, dumps, result_record
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_PENDING = 64
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+PREPARE_TIMEOUT = 120.0  # seconds for the sieve + extraction of one file
+
+
+def _warm_up():
+    """Runs once per worker so the first real request doesn't pay for imports:
+    the sieve/extraction modules and oletools.olevba (otherwise imported on
+    the first document with macros)"""
+    import batch_scan  # Model, ooxml_stream, lxml
+    from Office2JSON import _get_olevba
+    _get_olevba()
+    return os.getpid()
+
+
+class ScanService:
+    """Pool + model + cache shared by all request threads.
+
+    workers:            sieve/extraction processes, started and warmed up front
+    inference_workers:  concurrent Ollama requests
+    max_pending:        requests allowed in flight before /scan returns 503
+    similarity:         optional SimilarityIndex; near-duplicates inherit verdicts
+    pre_classifier:     optional PreClassifier; only its uncertain band reaches the model
+    batch_size:         documents from concurrent requests sent in one model
+                        request (see llm_batch; 1 = one each)
+    max_wait:           seconds a document waits for a batch to fill
+    sink:               optional VerdictSink; every result is appended to it
+    """
+
+    def __init__(self, analyst=None, workers=None, inference_workers=1, cache=None,
+                 max_pending=DEFAULT_MAX_PENDING, prepare_timeout=PREPARE_TIMEOUT, similarity=None,
+                 pre_classifier=None, batch_size=DEFAULT_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT, sink=None):
+        self.analyst = analyst or LocalMalwareScanner()
+        self.cache = cache
+        self.sink = sink
+        self.similarity = similarity
+        self.pre_classifier = pre_classifier
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max(1, max_pending)
+        self.prepare_timeout = prepare_timeout
+        self.started = time.time()
+
+        self._model_slots = threading.BoundedSemaphore(max(1, inference_workers))
+        self._batcher = None
+        if batch_size > 1:
+            self._batcher = VerdictBatcher(self.analyst, batch_size, max_wait, workers=inference_workers)
+        self._lock = threading.Lock()
+        self.counts = {"pending": 0, "preparing": 0, "waiting_for_model": 0, "at_model": 0,
+                       "scanned": 0, "rejected": 0}
+        self._pool = None
+        self._start_pool()
+
+    def _start_pool(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        for future in [self._pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def _count(self, key, delta):
+        with self._lock:
+            self.counts[key] += delta
+
+    def try_admit(self):
+        """Reserves a slot for one request; False when the service is full"""
+        with self._lock:
+            if self.counts["pending"] >= self.max_pending:
+                self.counts["rejected"] += 1
+                return False
+            self.counts["pending"] += 1
+            return True
+
+    def release(self):
+        self._count("pending", -1)
+
+    def queue_state(self):
+        with self._lock:
+            state = dict(self.counts)
+        state["max_pending"] = self.max_pending
+        state["workers"] = self.workers
+        return state
+
+    def _prepare(self, source, name):
+        metrics = get_metrics()
+        self._count("preparing", 1)
+        try:
+            pool = self._pool
+            try:
+                result = pool.submit(prepare_file, source, metrics.enabled, name).result(self.prepare_timeout)
+            except BrokenProcessPool:
+                # A worker died (OOM, segfault in a parser): start a fresh pool for the next request
+                with self._lock:
+                    if self._pool is pool:
+                        self._start_pool()
+                raise
+        finally:
+            self._count("preparing", -1)
+        metrics.merge(result.pop("metrics", None))
+        return result
+
+    def scan(self, source, name, sha256):
+        """Full verdict for one document (a path or its bytes) as a result dict"""
+        start = time.perf_counter()
+        model, version = self.analyst.model, self.analyst.PROMPT_VERSION
+
+        hit = self.cache.get(sha256, model, version) if self.cache is not None else None
+        get_metrics().inc("cache_total", result="miss" if hit is None else "hit")
+        if hit is not None:
+            hit.update({"file": name, "sha256": sha256, "error": None, "cached": True})
+            result = hit
+        else:
+            try:
+                result = self._prepare(source, name)
+            except Exception as e:
+                result = {"file": name, "suspicious": False, "verdict": None,
+                          "error": str(e) or type(e).__name__}
+            result["sha256"] = sha256
+            result["cached"] = False
+
+            if result["suspicious"] and not result["error"] and result["verdict"] is None:
+                pre_classify(self.pre_classifier, result)
+            if (self.similarity is not None and result["suspicious"] and not result["error"]
+                    and result["verdict"] is None):
+                match = self.similarity.query(result["paths"], model, version)
+                get_metrics().inc("similarity_total", result="miss" if match is None else "hit")
+                if match is not None:
+                    inherit(result, match)
+
+            if result["suspicious"] and not result["error"] and result["verdict"] is None:
+                result["prompt"] = {}
+                if self._batcher is not None:
+                    # The batcher's threads are the model slots; waiting includes the batch wait
+                    self._count("at_model", 1)
+                    try:
+                        result["verdict"] = self._batcher.submit(
+                            result.pop("content"), result["paths"], result["prompt"]).result()
+                    finally:
+                        self._count("at_model", -1)
+                else:
+                    self._count("waiting_for_model", 1)
+                    with self._model_slots:
+                        self._count("waiting_for_model", -1)
+                        self._count("at_model", 1)
+                        try:
+                            result["verdict"] = self.analyst.analyze(
+                                result.pop("content"), result["paths"], report=result["prompt"])
+                        finally:
+                            self._count("at_model", -1)
+                if self.similarity is not None:
+                    self.similarity.add(sha256, result["paths"], model, version, result["verdict"])
+            result.pop("content", None)
+
+            if self.cache is not None and not result["error"] and cacheable(result):
+                self.cache.put(sha256, model, version, result["suspicious"],
+                               result.get("paths"), result["verdict"])
+
+        outcome = "error" if result["error"] else "suspicious" if result["suspicious"] else "clean"
+        get_metrics().inc("files_total", outcome=outcome)
+        self._count("scanned", 1)
+        result["seconds"] = round(time.perf_counter() - start, 4)
+        if self.sink is not None:
+            self.sink.write(result)
+        return result
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._batcher is not None:
+            self._batcher.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.similarity is not None:
+            self.similarity.close()
+        if self.sink is not None:
+            self.sink.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._reply(200, {"status": "ok", "model": service.analyst.model,
+                              "workers": service.workers,
+                              "uptime": round(time.time() - service.started, 1)})
+        elif path == "/queue":
+            self._reply(200, service.queue_state())
+        elif path == "/metrics" and get_metrics().enabled:
+            self._reply(200, get_metrics().export_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._reply(404, {"error": f"unknown endpoint {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/scan":
+            self._drain()
+            self._reply(404, {"error": f"unknown endpoint {url.path}"})
+            return
+
+        query = parse_qs(url.query)
+        if "path" not in query:
+            # The body is the document: without its length there's nothing to scan
+            # (a missing or empty body must not come back as a clean verdict)
+            if self.headers.get("Content-Length") is None:
+                self.close_connection = True  # a chunked body would still be on the connection
+                self._reply(411, {"error": "Content-Length required (send the document as the body)"})
+                return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._reply(400, {"error": "invalid Content-Length"})
+            return
+        if length == 0 and "path" not in query:
+            self._reply(400, {"error": "empty body (send the document, or ?path= a file to scan)"})
+            return
+        if length > MAX_UPLOAD_BYTES:
+            self.close_connection = True
+            self._reply(413, {"error": f"document larger than {MAX_UPLOAD_BYTES} bytes"})
+            return
+
+        service = self.server.service
+        if not service.try_admit():
+            self._drain()
+            self._reply(503, {"error": "scanner busy"}, headers={"Retry-After": "1"})
+            return
+
+        try:
+            if "path" in query:
+                self._drain()
+                source = query["path"][0]
+                if not os.path.isfile(source):
+                    self._reply(404, {"error": f"no such file {source}"})
+                    return
+                name = query.get("name", [source])[0]
+                sha256 = calculate_sha256(source)
+            else:
+                source = self.rfile.read(length)
+                name = query.get("name", ["upload"])[0]
+                sha256 = hashlib.sha256(source).hexdigest()
+
+            self._reply(200, result_record(service.scan(source, name, sha256)))
+        except Exception as e:
+            # Batcher, index, cache or hashing failed: answer rather than drop the connection
+            get_metrics().inc("errors_total", stage="request")
+            self.close_connection = True
+            self._reply(500, {"error": f"scan failed: {str(e) or type(e).__name__}"})
+        finally:
+            service.release()
+
+    def _drain(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.close_connection = True
+            return
+        while length > 0:
+            chunk = self.rfile.read(min(length, 1024 * 1024))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def _reply(self, status, payload, content_type="application/json", headers=None):
+        data = payload if isinstance(payload, str) else dumps(payload)
+        data = data.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)  # BaseHTTPRequestHandler expects a (host, port) pair
+
+
+def _remove_stale_socket(path):
+    """Removes a Unix socket left by an earlier run; anything else at path
+    (a regular file, a socket a live daemon still answers on) is an error"""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        else:
+            raise OSError(f"{path} is in use by another server")
+    os.remove(path)
+
+
+def make_server(service, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None):
+    """HTTP server for service on host:port, or on a Unix socket when socket_path is set"""
+    if socket_path:
+        _remove_stale_socket(socket_path)
+        server = _UnixHTTPServer(socket_path, _Handler)
+        server.url = f"unix:{socket_path}"
+    else:
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        server.url = f"http://{host}:{server.server_address[1]}"
+    server.service = service
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser("scan_daemon")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes for the sieve/extraction stage (default: all cores)")
+    parser.add_argument("--inference-workers", type=int, default=1, help="Concurrent Ollama requests")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help="Requests in flight before /scan answers 503")
+    parser.add_argument("--ollama-host", default=None, help="Ollama server (default: OLLAMA_HOST)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="SQLite verdict cache keyed by SHA-256")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--metrics", action="store_true", help="Record metrics and serve /metrics")
+    parser.add_argument("--similarity", nargs="?", const=DEFAULT_SIMILARITY_FILE,
+                        help="Let near-duplicates inherit verdicts (MinHash/LSH index, SQLite)")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--pre-classifier", nargs="?", const=DEFAULT_MODEL_FILE,
+                        help="Decide confident files with the structural pre-classifier (see pre_classifier.py)")
+    parser.add_argument("--defer-band", type=float, nargs=2, metavar=("LOW", "HIGH"),
+                        help="Pre-classifier probabilities between LOW and HIGH go to the model")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Documents from concurrent requests per model request")
+    parser.add_argument("--batch-wait", type=float, default=DEFAULT_MAX_WAIT,
+                        help="Seconds a document waits for a batch to fill")
+    parser.add_argument("--results-out", help="Append every result to this file, one JSON object per line")
+    args = parser.parse_args()
+
+    if args.metrics:
+        enable_metrics()
+
+    print("--- TSA Scan Daemon ---")
+    cache = None if args.no_cache else VerdictCache(args.cache)
+    similarity = SimilarityIndex(args.similarity, args.similarity_threshold) if args.similarity else None
+    pre_classifier = None
+    if args.pre_classifier:
+        pre_classifier = PreClassifier.load(args.pre_classifier, *(args.defer_band or (None, None)))
+    service = ScanService(LocalMalwareScanner(host=args.ollama_host), workers=args.workers,
+                          inference_workers=args.inference_workers, cache=cache,
+                          max_pending=args.max_pending, similarity=similarity,
+                          pre_classifier=pre_classifier, batch_size=args.batch_size, max_wait=args.batch_wait,
+                          sink=VerdictSink(args.results_out) if args.results_out else None)
+    server = make_server(service, args.host, args.port, args.socket)
+    print(f"[*] {service.workers} warm workers, listening on {server.url}")
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket:
+            try:
+                _remove_stale_socket(args.socket)
+            except OSError:
+                pass  # replaced by someone else's socket since; leave it
+        print("[*] Stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import os
-import csv
-import hashlib
 import zipfile
+import argparse
+
+from file_index import FileIndex, DEFAULT_INDEX_FILE
+from labels_store import LabelsStore
+from verdict_cache import calculate_sha256
 
 # CONFIGURATION
 # Dynamic paths to work on both Docker and Local
@@ -21,64 +24,67 @@ def is_valid_ooxml(filepath):
     except:
         return False
 
-def calculate_sha256(filepath):
-    sha256_hash = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
-
-def scan_and_log():
+def scan_and_log(incremental=False, index_file=DEFAULT_INDEX_FILE):
+    """Appends new malware samples to labels.csv. With incremental=True only
+    files that are new or changed since the last incremental run are looked at."""
     print(f"[*] Scanning {MALWARE_DIR} for valid OOXML malware...")
     
-    # 1. Ensure CSV exists with Headers
-    if not os.path.exists(LABELS_FILE):
-        with open(LABELS_FILE, 'w', newline='') as f:
-            csv.writer(f).writerow(["sha256", "filename", "label", "source"])
+    if not os.path.exists(MALWARE_DIR):
+        print(f"[-] Error: {MALWARE_DIR} does not exist.")
+        return
 
-    # 2. Read existing hashes to avoid duplicates
-    existing_hashes = set()
-    with open(LABELS_FILE, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            existing_hashes.add(row.get('sha256', ''))
+    # 1. Known samples live in the labels store (new rows are appended to labels.csv on close)
+    labels = LabelsStore(csv_path=LABELS_FILE)
 
-    # 3. Iterate through files
+    # 2. Iterate through files
     added_count = 0
     skipped_count = 0
-    
-    if not os.path.exists(MALWARE_DIR):
-        print(f"[-] Error: {MALWARE_DIR} does not exist.")
-        return
 
-    with open(LABELS_FILE, 'a', newline='') as f:
-        writer = csv.writer(f)
+    # With an index, only new or changed files (already hashed); otherwise everything
+    index = FileIndex(index_file) if incremental else None
+    changes = {}
+    if index is not None:
+        changes = {change.path: change for change in index.changes(MALWARE_DIR, "scan_malware")}
+        filepaths = list(changes)
+        print(f"[*] {len(filepaths)} new or changed file(s)")
+    else:
+        filepaths = [os.path.join(MALWARE_DIR, filename) for filename in os.listdir(MALWARE_DIR)]
+
+    for filepath in filepaths:
+        filename = os.path.basename(filepath)
+        change = changes.get(filepath)
         
-        for filename in os.listdir(MALWARE_DIR):
-            filepath = os.path.join(MALWARE_DIR, filename)
-            
-            if os.path.isdir(filepath) or filename.startswith('.'):
-                continue
-            
-            # --- THE CRITICAL CHECK ---
-            if not is_valid_ooxml(filepath):
-                print(f"    [SKIP] {filename} (Invalid Format/Not a Zip)")
-                skipped_count += 1
-                continue
-            
-            # Calculate Hash
-            file_hash = calculate_sha256(filepath)
+        if os.path.isdir(filepath) or filename.startswith('.'):
+            continue
+        
+        # --- THE CRITICAL CHECK ---
+        if not is_valid_ooxml(filepath):
+            print(f"    [SKIP] {filename} (Invalid Format/Not a Zip)")
+            skipped_count += 1
+        else:
+            # Calculate Hash (the index already did, for changed files)
+            file_hash = change.sha256 if change is not None else calculate_sha256(filepath)
             
-            if file_hash in existing_hashes:
+            # Add unless the hash is already labelled (under any filename)
+            if labels.add(file_hash, filename, "Malicious", "Local_Scan"):
+                print(f"    [ADDED] {filename}")
+                added_count += 1
+            else:
                 print(f"    [SKIP] {filename} (Already in CSV)")
-                continue
-            
-            # Write to CSV
-            writer.writerow([file_hash, filename, "Malicious", "Local_Scan"])
-            print(f"    [ADDED] {filename}")
-            added_count += 1
+        
+        if change is not None:
+            index.mark("scan_malware", change)
+
+    labels.close()
+    if index is not None:
+        index.close()
 
     print(f"\n[+] Done. Added {added_count} valid files. Skipped {skipped_count} invalid files.")
 
 if __name__ == "__main__":
-    scan_and_log()
\ No newline at end of file
+    parser = argparse.ArgumentParser("scan_malware")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only look at files that are new or changed since the last incremental run")
+    parser.add_argument("--index", default=DEFAULT_INDEX_FILE, help="SQLite index used by --incremental")
+    args = parser.parse_args()
+    scan_and_log(args.incremental, args.index)
@@ -0,0 +1,234 @@
+"""Near-duplicate lookup over SFEM path sets (MinHash + LSH banding).
+
+A campaign sends thousands of documents built from one template that differ
+only in a URL or a payload byte: different SHA-256, so the verdict cache
+misses, but the same structural paths. SimilarityIndex remembers the path
+set of every document the model gave a verdict for, as a MinHash signature,
+and files it under LSH band keys in SQLite:
+
+    index = SimilarityIndex()
+    match = index.query(paths, model, PROMPT_VERSION)
+    if match:                         # {"sha256", "similarity", "verdict", ...}
+        verdict = match["verdict"]    # inherited, no model call
+    else:
+        verdict = analyst.analyze(content, paths)
+        index.add(sha256, paths, model, PROMPT_VERSION, verdict)
+
+A query only looks at documents that share at least one band with the new
+signature (a few indexed lookups, whatever the index size), then keeps the
+best one whose estimated Jaccard similarity reaches `threshold`. With the
+defaults (128 hashes in 16 bands of 8) pairs at 0.9 similarity are found
+>99% of the time and pairs under 0.5 rarely become candidates at all.
+
+Documents that inherited a verdict are not added: the first one seen stands
+for the whole cluster, and its `members` count goes up.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from verdict_cache import is_error_verdict
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+DEFAULT_INDEX_FILE = os.path.join(PROJECT_ROOT, "data", "similarity_index.db")
+
+NUM_PERM = 128
+BANDS = 16
+DEFAULT_THRESHOLD = 0.9
+MIN_PATHS = 8  # smaller sets are too generic to stand for a campaign
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _permutations(num_perm, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+_PERMS = {}
+
+
+def minhash(paths, num_perm=NUM_PERM):
+    """uint32 signature of a set of path strings. The same set always gives
+    the same signature (in any process), so signatures can be stored."""
+    if num_perm not in _PERMS:
+        _PERMS[num_perm] = _permutations(num_perm)
+    a, b = _PERMS[num_perm]
+
+    hv = np.fromiter((zlib.crc32(p.encode("utf-8")) for p in set(paths)), dtype=np.uint64)
+    if hv.size == 0:
+        return np.full(num_perm, _MAX_HASH, dtype=np.uint32)
+    with np.errstate(over="ignore"):
+        phv = ((np.outer(hv, a) + b) % _PRIME) & _MAX_HASH
+    return phv.min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature, bands=BANDS):
+    """One 64-bit key per band of rows"""
+    keys = []
+    for band in np.split(signature, bands):
+        digest = zlib.crc32(band.tobytes()) << 32 | zlib.adler32(band.tobytes())
+        keys.append(digest - (1 << 63))  # SQLite integers are signed
+    return keys
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of the two path sets"""
+    return float(np.count_nonzero(sig_a == sig_b)) / sig_a.size
+
+
+class SimilarityIndex:
+    """SQLite-backed; safe to share between threads of one process.
+
+    threshold:  minimum estimated similarity for a verdict to be inherited
+    """
+
+    def __init__(self, db_path=DEFAULT_INDEX_FILE, threshold=DEFAULT_THRESHOLD,
+                 num_perm=NUM_PERM, bands=BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.db_path = db_path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                num_perm INTEGER NOT NULL,
+                signature BLOB NOT NULL,
+                verdict TEXT NOT NULL,
+                members INTEGER NOT NULL DEFAULT 1,
+                created REAL NOT NULL,
+                UNIQUE (sha256, model, prompt_version, num_perm)
+            )""")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS bands (
+                key INTEGER NOT NULL,
+                band INTEGER NOT NULL,
+                doc INTEGER NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands (key, band)")
+        self._db.commit()
+
+    def signature(self, paths):
+        return minhash(paths, self.num_perm)
+
+    def query(self, paths, model, prompt_version, signature=None):
+        """Best indexed document at or above the threshold, as
+        {"sha256", "similarity", "verdict", "members"}, or None"""
+        if len(paths) < MIN_PATHS:
+            return None
+        signature = self.signature(paths) if signature is None else signature
+        keys = band_keys(signature, self.bands)
+
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(keys):
+                candidates.update(row[0] for row in self._db.execute(
+                    "SELECT doc FROM bands WHERE key = ? AND band = ?", (key, band)))
+            if not candidates:
+                return None
+
+            best = None
+            for doc in candidates:
+                row = self._db.execute(
+                    "SELECT sha256, signature, verdict, members FROM docs "
+                    "WHERE id = ? AND model = ? AND prompt_version = ? AND num_perm = ?",
+                    (doc, model, prompt_version, self.num_perm)).fetchone()
+                if row is None:
+                    continue
+                score = similarity(signature, np.frombuffer(row[1], dtype=np.uint32))
+                if score >= self.threshold and (best is None or score > best[0]):
+                    best = (score, doc, row)
+            if best is None:
+                return None
+
+            score, doc, row = best
+            self._db.execute("UPDATE docs SET members = members + 1 WHERE id = ?", (doc,))
+            self._db.commit()
+
+        return {"sha256": row[0], "similarity": round(score, 3), "verdict": row[2], "members": row[3] + 1}
+
+    def add(self, sha256, paths, model, prompt_version, verdict, signature=None):
+        """Indexes a document the model gave a verdict for; False if it was not added
+        (too few paths, no usable verdict, or already indexed). Error verdicts,
+        resource-limit refusals included, are never indexed."""
+        if len(paths) < MIN_PATHS or not verdict or is_error_verdict(verdict) or '"resource_limit"' in verdict:
+            return False
+        signature = self.signature(paths) if signature is None else signature
+
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO docs (sha256, model, prompt_version, num_perm, signature, verdict, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sha256, model, prompt_version, self.num_perm, signature.astype(np.uint32).tobytes(),
+                 verdict, time.time()))
+            if cursor.rowcount == 0:
+                return False
+            doc = cursor.lastrowid
+            self._db.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                                 [(key, band, doc) for band, key in enumerate(band_keys(signature, self.bands))])
+            self._db.commit()
+        return True
+
+    def clusters(self, model=None, limit=20):
+        """Largest clusters first: [{"sha256", "members", "verdict"}]"""
+        sql = "SELECT sha256, members, verdict FROM docs"
+        args = ()
+        if model is not None:
+            sql += " WHERE model = ?"
+            args = (model,)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY members DESC LIMIT ?", args + (limit,)).fetchall()
+        return [{"sha256": r[0], "members": r[1], "verdict": r[2]} for r in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def inherit(result, match):
+    """Puts a match's verdict on a scan result and records where it came from"""
+    result["verdict"] = match["verdict"]
+    result["similar_to"] = {k: match[k] for k in ("sha256", "similarity", "members")}
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("similarity_index")
+    parser.add_argument("--db", default=DEFAULT_INDEX_FILE)
+    parser.add_argument("--top", type=int, default=20, help="Show the largest clusters")
+    args = parser.parse_args()
+
+    index = SimilarityIndex(args.db)
+    print(f"[*] {len(index)} documents indexed")
+    for cluster in index.clusters(limit=args.top):
+        try:
+            score = json.loads(cluster["verdict"]).get("score")
+        except ValueError:
+            score = None
+        print(f"    {cluster['sha256'][:12]}...  {cluster['members']:6d} members  score {score}")
+    index.close()
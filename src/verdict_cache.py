@@ -0,0 +1,150 @@
+"""Persistent verdict cache keyed by file content.
+
+The same attachments come back again and again (mass mailings, re-sent
+invoices). Entries are keyed by (SHA-256, model name, prompt version), so a
+repeat file skips the sieve, the extraction and the model call, while a new
+model or a prompt change naturally misses. Stored in SQLite, with a TTL and
+a maximum entry count (least recently used entries go first). Hits don't
+write: their last_used times are kept in memory and written in one batch
+with the next put, eviction sweep or close (or every TOUCH_BATCH hits).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+DEFAULT_CACHE_FILE = os.path.join(PROJECT_ROOT, "data", "verdict_cache.db")
+
+DEFAULT_TTL = 30 * 24 * 3600  # seconds
+DEFAULT_MAX_ENTRIES = 500_000
+EVICT_EVERY = 1000  # puts between eviction sweeps
+TOUCH_BATCH = 1000  # pending last_used updates before they are written anyway
+
+
+def calculate_sha256(filepath):
+    """SHA-256 of a file's content, read in 1 MiB blocks (shared by all the scripts)"""
+    sha256_hash = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+
+def is_error_verdict(verdict_str):
+    """Connection errors come back as score -1.0; those must not be cached"""
+    try:
+        return json.loads(verdict_str).get("score") == -1.0
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
+class VerdictCache:
+    """SQLite-backed cache; safe to share between threads of one process"""
+
+    def __init__(self, db_path=DEFAULT_CACHE_FILE, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._touched = {}  # (sha256, model, prompt_version) -> last hit, not written yet
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                sha256 TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                suspicious INTEGER NOT NULL,
+                paths TEXT,
+                verdict TEXT,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (sha256, model, prompt_version)
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        self._db.commit()
+
+    def get(self, sha256, model, prompt_version):
+        """Returns {"suspicious", "paths", "verdict"} or None on a miss / expired entry"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT suspicious, paths, verdict, created FROM verdicts "
+                "WHERE sha256 = ? AND model = ? AND prompt_version = ?",
+                (sha256, model, prompt_version)).fetchone()
+            if row is None:
+                return None
+
+            if self.ttl and now - row[3] > self.ttl:
+                self._db.execute(
+                    "DELETE FROM verdicts WHERE sha256 = ? AND model = ? AND prompt_version = ?",
+                    (sha256, model, prompt_version))
+                self._db.commit()
+                return None
+
+            self._touched[(sha256, model, prompt_version)] = now
+            if len(self._touched) >= TOUCH_BATCH:
+                self._write_touched()
+                self._db.commit()
+
+        return {
+            "suspicious": bool(row[0]),
+            "paths": json.loads(row[1]) if row[1] else [],
+            "verdict": row[2],
+        }
+
+    def put(self, sha256, model, prompt_version, suspicious, paths, verdict):
+        if verdict is not None and is_error_verdict(verdict):
+            return
+
+        now = time.time()
+        with self._lock:
+            self._write_touched()
+            self._db.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (sha256, model, prompt_version, int(bool(suspicious)),
+                 json.dumps(list(paths or [])), verdict, now, now))
+            self._db.commit()
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def evict(self):
+        """Drops expired entries, then the least recently used ones above max_entries"""
+        with self._lock:
+            self._evict(time.time())
+
+    def _write_touched(self):
+        """Queues the pending last_used updates in the current transaction"""
+        if self._touched:
+            self._db.executemany(
+                "UPDATE verdicts SET last_used = ? WHERE sha256 = ? AND model = ? AND prompt_version = ?",
+                [(used,) + key for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def _evict(self, now):
+        self._write_touched()  # recency must be current before the LRU cut
+        if self.ttl:
+            self._db.execute("DELETE FROM verdicts WHERE created < ?", (now - self.ttl,))
+        if self.max_entries:
+            self._db.execute("""
+                DELETE FROM verdicts WHERE rowid IN (
+                    SELECT rowid FROM verdicts ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._evict(time.time())
+            self._db.close()
@@ -0,0 +1,214 @@
+"""Typed verdicts: parsing, validation, repair and a JSON-lines sink.
+
+Verdicts travel between stages (cache, similarity index, daemon replies) as
+JSON strings {"score": 0-10, "reason": ...}, with score -1.0 for a failed
+model call. Model replies are normalized into that shape here, once, as they
+come in:
+
+    verdict = parse_verdict(reply)    # Verdict(score=7.0, reason="...")
+    verdict_str = verdict.to_json()
+
+A reply that isn't quite JSON (a code fence around it, single quotes,
+unquoted keys, trailing commas, cut off mid-string, score as "7/10") is
+repaired; one that still doesn't fit the schema raises VerdictError.
+
+VerdictSink appends one JSON line per scan result through a write buffer:
+
+    with VerdictSink("results.jsonl") as sink:
+        for result in scanner.scan(files):
+            sink.write(result)
+
+JSON goes through orjson when it is installed, the json module otherwise.
+"""
+import ast
+import json
+import math
+import re
+import threading
+from dataclasses import dataclass
+
+try:
+    import orjson
+except ImportError:  # optional; same output, just slower
+    orjson = None
+
+ERROR_SCORE = -1.0
+MAX_SCORE = 10.0
+SINK_BUFFER = 256 * 1024  # bytes
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_UNQUOTED_KEY = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:')
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_STRING = re.compile(r'("(?:\\.|[^"\\])*")')
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+class VerdictError(ValueError):
+    """A reply that can't be read as a verdict"""
+
+
+def dumps(obj):
+    """Compact JSON text"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    return json.dumps(obj, default=str, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(text):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+@dataclass(slots=True)
+class Verdict:
+    score: float
+    reason: str
+    resource_limit: dict = None
+    repaired: bool = False  # the reply needed repair (not serialized)
+
+    def __post_init__(self):
+        if isinstance(self.score, bool) or not isinstance(self.score, (int, float)):
+            raise VerdictError(f"score must be a number, got {type(self.score).__name__}")
+        self.score = float(self.score)
+        if not (0.0 <= self.score <= MAX_SCORE or self.score == ERROR_SCORE):
+            raise VerdictError(f"score {self.score} outside 0-{MAX_SCORE:g}")
+        if not isinstance(self.reason, str):
+            raise VerdictError(f"reason must be a string, got {type(self.reason).__name__}")
+        if self.resource_limit is not None and not isinstance(self.resource_limit, dict):
+            raise VerdictError("resource_limit must be an object")
+
+    @property
+    def is_error(self):
+        return self.score == ERROR_SCORE
+
+    @classmethod
+    def from_dict(cls, data, lenient=False):
+        """Strict unless lenient: then a score given as text ("7", "7/10") is
+        read as its leading number. Keys other than the schema's are dropped."""
+        if not isinstance(data, dict):
+            raise VerdictError(f"expected an object, got {type(data).__name__}")
+        if "score" not in data or "reason" not in data:
+            raise VerdictError("missing " + " and ".join(k for k in ("score", "reason") if k not in data))
+        score = data["score"]
+        if lenient and isinstance(score, str):
+            match = _NUMBER.search(score)
+            if match is None:
+                raise VerdictError(f"score {score!r} is not a number")
+            score = float(match.group())
+        if isinstance(score, float) and not math.isfinite(score):
+            raise VerdictError("score is not finite")
+        return cls(score, data["reason"], data.get("resource_limit"), repaired=lenient)
+
+    def to_dict(self):
+        data = {"score": self.score, "reason": self.reason}
+        if self.resource_limit is not None:
+            data["resource_limit"] = self.resource_limit
+        return data
+
+    def to_json(self):
+        return dumps(self.to_dict())
+
+
+def error_verdict(message):
+    return Verdict(ERROR_SCORE, message)
+
+
+def repair_json(text):
+    """Best-effort cleanup of near-JSON model output"""
+    text = _FENCE.sub("", text.translate(_SMART_QUOTES)).strip()
+    start = text.find("{")
+    if start > 0:
+        text = text[start:]
+    end = text.rfind("}")
+    if end != -1 and text.count("{") == text.count("}"):
+        text = text[:end + 1]
+
+    # Cut off mid-reply: close the open string, then the open brackets
+    if text.count('"') % 2:
+        text += '"'
+    text += "]" * max(text.count("[") - text.count("]"), 0)
+    text += "}" * max(text.count("{") - text.count("}"), 0)
+
+    # Bare keys and trailing commas, outside string literals only
+    parts = _STRING.split(text)
+    for i in range(0, len(parts), 2):
+        parts[i] = _TRAILING_COMMA.sub(r"\1", _UNQUOTED_KEY.sub(r'\1"\2":', parts[i]))
+    return "".join(parts)
+
+
+def load_json(text):
+    """(data, repaired): parses text as JSON, repairing it if it has to"""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", "replace")
+    if not isinstance(text, str):
+        raise VerdictError(f"expected text, got {type(text).__name__}")
+    try:
+        return loads(text), False
+    except ValueError:
+        pass
+
+    fixed = repair_json(text)
+    try:
+        return json.loads(fixed), True
+    except ValueError:
+        pass
+    try:
+        # Python-style dicts: {'score': 7, 'reason': 'x', 'ok': True}
+        return ast.literal_eval(fixed), True
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise VerdictError(f"not JSON: {text[:80]!r}") from None
+
+
+def parse_verdict(text):
+    """Verdict from a model reply; raises VerdictError"""
+    data, repaired = load_json(text)
+    return Verdict.from_dict(data, lenient=repaired)
+
+
+def result_record(result):
+    """Scan result dict -> what gets written out (JSON lines, daemon replies):
+    the verdict string inlined as an object, the path list left out"""
+    record = dict(result)
+    record.pop("paths", None)  # can be thousands of entries
+    record.pop("content", None)
+    verdict = record.get("verdict")
+    if isinstance(verdict, str):
+        try:
+            record["verdict"] = loads(verdict)
+        except ValueError:
+            pass
+    return record
+
+
+class VerdictSink:
+    """Appends one JSON line per scan result; safe to share between threads.
+    Lines go through a `buffer_size` write buffer and reach the file on
+    flush(), close() or when the buffer fills."""
+
+    def __init__(self, path, buffer_size=SINK_BUFFER):
+        self.path = path
+        self.written = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "ab", buffering=buffer_size)
+
+    def write(self, result):
+        line = dumps(result_record(result)).encode("utf-8") + b"\n"
+        with self._lock:
+            self._file.write(line)
+            self.written += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False